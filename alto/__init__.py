@@ -11,7 +11,12 @@
 # The above copyright notice and this permission notice shall be included in all
 # copies or substantial portions of the Software.
 """Alto is a command line tool for running Singer taps and targets."""
-from alto.catalog import CatalogMutationStrategy, apply_metadata, apply_selected
+from alto.catalog import (
+    CatalogMutationStrategy,
+    apply_metadata,
+    apply_selected,
+    apply_selected_and_metadata,
+)
 from alto.config import working_directory
 from alto.constants import (
     ALTO_DB_FILE,
@@ -76,6 +81,7 @@ __all__ = [
     "CatalogMutationStrategy",
     "apply_selected",
     "apply_metadata",
+    "apply_selected_and_metadata",
     # state
     "ensure_state",
     "parse_state_from_stdout",
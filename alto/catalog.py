@@ -11,19 +11,27 @@
 # The above copyright notice and this permission notice shall be included in all
 # copies or substantial portions of the Software.
 """Catalog utilities."""
-import copy
 import fnmatch
 import json
+import os
+import re
 import typing as t
 from enum import Enum
 from pathlib import Path
 
-from alto.models import SingerCatalog, SingerCatalogStreamMetadata
+from alto.logger import LOGGER
+from alto.models import SingerCatalog, SingerCatalogStream, SingerCatalogStreamMetadata
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 __all__ = [
     "CatalogMutationStrategy",
     "apply_selected",
     "apply_metadata",
+    "apply_selected_and_metadata",
 ]
 
 
@@ -37,55 +45,102 @@ class CatalogMutationStrategy(str, Enum):
     DESELECT = "deselect"
 
 
+def _catalog_indent() -> t.Optional[int]:
+    """Return the indent set by ALTO_CATALOG_INDENT, or None if it is unset or invalid"""
+    value = os.getenv("ALTO_CATALOG_INDENT")
+    if not value:
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        LOGGER.warning(f"Ignoring ALTO_CATALOG_INDENT={value!r}, it must be an integer.")
+        return None
+
+
+_CATALOG_INDENT = _catalog_indent()
+"""The indent catalogs are written with by default, read once from the environment."""
+
+
+def _write_catalog(path: Path, catalog: SingerCatalog, indent: t.Optional[int] = None) -> None:
+    """Write the catalog to the path, using orjson if it is installed
+
+    The catalog is written compactly unless an indent is given. Set ALTO_CATALOG_INDENT
+    to indent catalogs by default, which is handy when debugging a selection."""
+    if indent is None:
+        indent = _CATALOG_INDENT
+    data = catalog.to_dict()
+    if orjson is not None and indent in (None, 2):
+        try:
+            path.write_bytes(orjson.dumps(data, option=orjson.OPT_INDENT_2 if indent else None))
+            return
+        except orjson.JSONEncodeError:
+            pass  # Fall back for values orjson rejects, such as integers over 64 bits
+    separators = (",", ":") if indent is None else None
+    path.write_text(json.dumps(data, indent=indent, separators=separators))
+
+
+_GLOB_CHARS = frozenset("*?[")
+"""Characters which make a pattern a glob rather than a literal."""
+
+_CASE_SENSITIVE = os.path.normcase("A") == "A"
+"""Whether fnmatch compares names case sensitively on this platform, it does not on Windows."""
+
+
+def _is_literal(pattern: str) -> bool:
+    """Return whether a pattern contains no glob characters and can be compared with ==.
+
+    Where names are case insensitive every pattern is matched as a glob instead.
+    """
+    return _CASE_SENSITIVE and _GLOB_CHARS.isdisjoint(pattern)
+
+
+def _compile_glob(pattern: str) -> t.Callable[[str], t.Optional[t.Match[str]]]:
+    """Compile a glob pattern once into a reusable matcher.
+
+    Like fnmatch.fnmatch, both the pattern and the name are normalized with normcase.
+    """
+    match = re.compile(fnmatch.translate(os.path.normcase(pattern))).match
+    if _CASE_SENSITIVE:
+        return match
+    return lambda name: match(os.path.normcase(name))
+
+
+_SelectionRule = t.Tuple[int, t.Optional[t.Callable[[str], t.Any]], bool]
+"""A compiled selection: declaration order, breadcrumb matcher (None matches all), inverted."""
+
+
 def _remove_breadcrumb_from_schema(
     schema: t.Dict[str, t.Any], entry: SingerCatalogStreamMetadata
 ) -> None:
-    parent = []
-    schema_ptr = copy.copy(schema)
+    # Track the (container, key) pairs used to descend so an emptied object
+    # can be pruned from its parent without re-walking the schema from the root
+    parents: t.List[t.Tuple[t.Dict[str, t.Any], str]] = []
+    breadcrumb = entry.breadcrumb
+    last = len(breadcrumb) - 1
     try:
-        while len(entry.breadcrumb) > 0:
-            prop = entry.breadcrumb.pop(0)
-            if len(entry.breadcrumb) == 0:
+        for i, prop in enumerate(breadcrumb):
+            if i == last:
                 schema.pop(prop, None)
-                if not schema and len(parent) > 2:
-                    inner = schema_ptr
-                    for path in parent[:-2]:
-                        inner = inner[path]
-                    inner.pop(parent[-2], None)
+                if not schema and len(parents) > 2:
+                    container, key = parents[-2]
+                    container.pop(key, None)
+                break
+            parents.append((schema, prop))
+            schema = schema.get(prop)
+            if not schema:
                 break
-            else:
-                schema = schema.get(prop)
-                if not schema:
-                    break
-            parent.append(prop)
     except (KeyError, IndexError):
         pass
 
 
-def _select_attribute(attribute: SingerCatalogStreamMetadata) -> bool:
-    propagated = True
-    entry = attribute.metadata
-    selected_by_default = entry.get("selected-by-default", False)
-    is_selected = entry.get("selected")
-    # Apply the selection and return the propagation state
-    if is_selected:
-        return propagated
-    if is_selected is None and selected_by_default:
-        entry["selected"] = True
-        return propagated
-    if not is_selected and entry.get("inclusion") == "automatic":
-        entry["selected"] = True
-        return not propagated
-    return not propagated
-
-
 def apply_selected(
-    target_catalog: t.Union[Path, str, SingerCatalog],
+    target_catalog: t.Union[Path, str, t.Dict[str, t.Any], SingerCatalog],
     selections: t.List[str],
     write: bool = True,
     strategy: CatalogMutationStrategy = CatalogMutationStrategy.PRUNE,
+    indent: t.Optional[int] = None,
 ) -> SingerCatalog:
-    """Applies the selected streams and attributes to the target catalog in two passes:
+    """Applies the selected streams and attributes to the target catalog in two passes per stream:
 
     - Pass-1 - apply attribute level selections / negations in sequence
     - Pass-2 - apply stream selections / deletions based on attribute selections
@@ -100,24 +155,21 @@ def apply_selected(
     if all(selection.startswith(("!", "~")) for selection in selections):
         selections.insert(0, "*.*")
 
-    patterns = [
-        (stream.lstrip("!"), ".".join(breadcrumb), stream.startswith("!"))
-        for stream, breadcrumb in (
-            (
-                selection.split(".", 1)[0],
-                selection.split(".", 1)[1:] if selection.count(".") > 0 else ["*"],
-            )
-            for selection in selections
-            if not selection.startswith("~")
+    patterns: t.List[t.Tuple[str, str, bool]] = []
+    for selection in selections:
+        if selection.startswith("~"):
+            continue
+        stream, dot, breadcrumb = selection.partition(".")
+        patterns.append(
+            (stream.lstrip("!"), breadcrumb if dot else "*", selection.startswith("!"))
         )
-    ]
 
     # Parse the catalog
     if isinstance(target_catalog, Path):
         catalog = SingerCatalog.parse_file(target_catalog)
     elif isinstance(target_catalog, str):
         catalog = SingerCatalog.parse_str(target_catalog)
-    elif isinstance(target_catalog, t.dict):
+    elif isinstance(target_catalog, dict):
         catalog = SingerCatalog.parse_json(target_catalog)
     else:
         catalog: SingerCatalog = target_catalog
@@ -127,71 +179,139 @@ def apply_selected(
     if all(inverted for _, _, inverted in patterns):
         patterns.insert(0, ("*", "*", False))
 
-    # Pass-1
+    # Compile the globs once rather than on every match. Literal stream names are
+    # indexed for direct lookup and a `*` breadcrumb glob is applied unconditionally
+    literal_rules: t.Dict[str, t.List[_SelectionRule]] = {}
+    wildcard_rules: t.List[t.Tuple[t.Callable[[str], t.Any], _SelectionRule]] = []
+    for ix, (stream_glob, breadcrumb_glob, invert) in enumerate(patterns):
+        rule = (ix, None if breadcrumb_glob == "*" else _compile_glob(breadcrumb_glob), invert)
+        if _is_literal(stream_glob):
+            literal_rules.setdefault(stream_glob, []).append(rule)
+        else:
+            wildcard_rules.append((_compile_glob(stream_glob), rule))
+
+    # Streams and attributes are dropped by rebuilding their lists once rather than
+    # popping them one at a time, which shifts the tail of the list on every call
+    streams_to_keep: t.List[SingerCatalogStream] = []
+    streams_to_remove: t.List[SingerCatalogStream] = []
     for stream in catalog.streams:
+        # Resolve the rules which apply to this stream before touching its metadata
         stream_id = stream.tap_stream_id
-        root_ix = next((i for i, entry in enumerate(stream.metadata) if entry.is_root), None)
+        rules = literal_rules.get(stream_id, []) + [
+            rule for stream_match, rule in wildcard_rules if stream_match(stream_id)
+        ]
+
+        # A stream without a root entry only gets one once we know it is needed. Until
+        # then root_selected tracks the selection Pass-1 would have given it
+        root_ix = stream.root_metadata_index()
+        root_selected: t.Optional[bool] = None
         if root_ix is not None:
             stream.metadata[root_ix].metadata.pop("selected", None)
-        else:
-            stream.metadata.append(SingerCatalogStreamMetadata(breadcrumb=[], metadata={}))
-        for stream_glob, breadcrumb_glob, invert in patterns:
-            if not fnmatch.fnmatch(stream_id, stream_glob):
+
+        # Both passes work on a flat list of selection flags parallel to the metadata
+        # rather than on each entry's dict, and write back only what changed at the end
+        metadata = stream.metadata
+        original = [entry.metadata.get("selected") for entry in metadata]
+        selected = original.copy()
+
+        # Pass-1, skipped entirely for streams no rule matches. Rules are applied in the
+        # order they were declared, so the last rule matching an attribute decides its
+        # selection. Visit each attribute once and test the rules latest first, stopping
+        # at the first match
+        if rules:
+            rules.sort(key=lambda rule: rule[0], reverse=True)
+            for k, attribute in enumerate(metadata):
+                breadcrumb = ".".join(attribute.breadcrumb[1:])
+                for _, breadcrumb_match, invert in rules:
+                    if breadcrumb_match is None or breadcrumb_match(breadcrumb):
+                        selected[k] = True ^ invert
+                        break
+            if root_ix is None:
+                for _, breadcrumb_match, invert in rules:
+                    if breadcrumb_match is None or breadcrumb_match(""):
+                        root_selected = True ^ invert
+                        break
+
+        # Pass-2, propagate selection. Selected attributes and those selected by default
+        # select the stream, automatic attributes are selected without selecting it
+        any_selected = bool(root_selected)
+        for k, entry in enumerate(metadata):
+            if selected[k]:
+                any_selected = True
                 continue
-            for attribute in stream.metadata:
-                if fnmatch.fnmatch(
-                    ".".join(attribute.get("breadcrumb", ["properties"])[1:]),
-                    breadcrumb_glob,
-                ):
-                    attribute.metadata["selected"] = True ^ invert
-
-    # Pass-2
-    streams_to_remove: t.List[int] = []
-    for i, stream in enumerate(catalog.streams):
+            if selected[k] is None and entry.metadata.get("selected-by-default", False):
+                selected[k] = any_selected = True
+            elif entry.metadata.get("inclusion") == "automatic":
+                selected[k] = True
+
         # Mark stream for removal if no attributes are selected
-        if not any(_select_attribute(attr) for attr in stream.metadata):
-            streams_to_remove.append(i)
+        if not any_selected:
+            if strategy != CatalogMutationStrategy.PRUNE:
+                # The stream stays in the catalog so its metadata must reflect both passes
+                for k, entry in enumerate(metadata):
+                    if selected[k] is not original[k]:
+                        entry.metadata["selected"] = selected[k]
+                if root_ix is None:
+                    metadata.append(
+                        SingerCatalogStreamMetadata(
+                            breadcrumb=[],
+                            metadata={} if root_selected is None else {"selected": root_selected},
+                        )
+                    )
+            streams_to_remove.append(stream)
             continue
+        streams_to_keep.append(stream)
 
         stream.selected = True
-        stream.metadata[
-            next((i for i, entry in enumerate(stream.metadata) if entry.is_root), 0)
-        ].metadata["selected"] = True
-
-        attr_to_remove: t.List[int] = []
-        for j, entry in enumerate(stream.metadata):
-            # Select ambiguous attributes
-            if entry.metadata.get("selected") is None:
-                entry.metadata["selected"] = True
-            # Mark attributes for removal
-            elif not entry.metadata["selected"]:
-                attr_to_remove.append(j)
-
-        # Remove attributes in reverse order to avoid index shifting
-        for j in reversed(attr_to_remove):
-            if strategy == CatalogMutationStrategy.PRUNE:
-                # Remove the property from the schema erring on the side of runtime safety
-                _remove_breadcrumb_from_schema(stream.schema, stream.metadata.pop(j))
-            elif strategy == CatalogMutationStrategy.DESELECT:
-                stream.metadata[j].metadata["selected"] = False
-
-    # Remove streams in reverse order to avoid index shifting
-    for i in reversed(streams_to_remove):
-        if strategy == CatalogMutationStrategy.PRUNE:
-            catalog.streams.pop(i)
-        elif strategy == CatalogMutationStrategy.DESELECT:
-            catalog.streams[i].selected = False
+        if root_ix is not None:
+            selected[root_ix] = True
+
+        # Select ambiguous attributes, sort out the unselected ones and write back
+        attr_to_keep: t.List[SingerCatalogStreamMetadata] = []
+        attr_to_remove: t.List[SingerCatalogStreamMetadata] = []
+        for k, entry in enumerate(metadata):
+            is_selected = selected[k]
+            if is_selected is None:
+                is_selected = True
+            elif not is_selected and k != root_ix:
+                attr_to_remove.append(entry)
+                if strategy == CatalogMutationStrategy.DESELECT:
+                    entry.metadata["selected"] = False
+                elif is_selected is not original[k] and strategy != CatalogMutationStrategy.PRUNE:
+                    entry.metadata["selected"] = is_selected
+                continue
+            if is_selected is not original[k]:
+                entry.metadata["selected"] = is_selected
+            attr_to_keep.append(entry)
+
+        if attr_to_remove and strategy == CatalogMutationStrategy.PRUNE:
+            stream.metadata = attr_to_keep
+            # Remove the properties from the schema erring on the side of runtime safety
+            for entry in reversed(attr_to_remove):
+                _remove_breadcrumb_from_schema(stream.schema, entry)
+
+        if root_ix is None:
+            stream.metadata.append(
+                SingerCatalogStreamMetadata(breadcrumb=[], metadata={"selected": True})
+            )
+
+    if strategy == CatalogMutationStrategy.PRUNE:
+        catalog.streams = streams_to_keep
+    elif strategy == CatalogMutationStrategy.DESELECT:
+        for stream in streams_to_remove:
+            stream.selected = False
 
     if write and isinstance(target_catalog, Path):
-        target_catalog.write_text(json.dumps(catalog.to_dict(), indent=2))
+        _write_catalog(target_catalog, catalog, indent=indent)
 
     return catalog
 
 
 def apply_metadata(
-    target_catalog: t.Union[Path, str, SingerCatalog],
+    target_catalog: t.Union[Path, str, t.Dict[str, t.Any], SingerCatalog],
     metadata: t.Dict[str, t.Dict[str, t.Any]],
     write: bool = True,
+    indent: t.Optional[int] = None,
 ) -> SingerCatalog:
     """Applies the metadata to the target catalog"""
 
@@ -202,23 +322,34 @@ def apply_metadata(
         catalog = SingerCatalog.parse_file(target_catalog)
     elif isinstance(target_catalog, str):
         catalog = SingerCatalog.parse_str(target_catalog)
+    elif isinstance(target_catalog, dict):
+        catalog = SingerCatalog.parse_json(target_catalog)
     else:
         catalog: SingerCatalog = target_catalog
 
+    # Index the streams and their root metadata so literal criteria do not scan
+    # the whole catalog and each stream's metadata is only searched once
+    streams: t.List[t.Tuple[SingerCatalogStream, t.Optional[int]]] = []
+    streams_by_id: t.Dict[str, t.List[t.Tuple[SingerCatalogStream, t.Optional[int]]]] = {}
+    for stream in catalog.streams:
+        entry = (stream, stream.root_metadata_index())
+        streams.append(entry)
+        streams_by_id.setdefault(stream.tap_stream_id, []).append(entry)
+
     for criteria, payload in metadata.items():
         # Ensure users cannot mess with selection which is handled by
         # dedicated apply_selected function
         payload.pop("selected", None)
 
-        for stream in catalog.streams:
-            # Skip streams that do not match the criteria
-            if not fnmatch.fnmatch(stream.tap_stream_id, criteria):
-                continue
+        if _is_literal(criteria):
+            targets = streams_by_id.get(criteria, [])
+        else:
+            criteria_match = _compile_glob(criteria)
+            targets = [entry for entry in streams if criteria_match(entry[0].tap_stream_id)]
 
+        for stream, root_ix in targets:
             # Apply the metadata to the root of the stream
-            stream.metadata[
-                next((i for i, entry in enumerate(stream.metadata) if entry.is_root), 0)
-            ].metadata.update(payload)
+            stream.metadata[root_ix or 0].metadata.update(payload)
 
             # Bubble up the metadata to the parent stream for legacy compatibility
             if "replication-method" in payload:
@@ -227,6 +358,31 @@ def apply_metadata(
                 stream.replication_key = payload["replication-key"]
 
     if write and isinstance(target_catalog, Path):
-        target_catalog.write_text(json.dumps(catalog.to_dict(), indent=2))
+        _write_catalog(target_catalog, catalog, indent=indent)
+
+    return catalog
+
+
+def apply_selected_and_metadata(
+    target_catalog: t.Union[Path, str, t.Dict[str, t.Any], SingerCatalog],
+    selections: t.List[str],
+    metadata: t.Dict[str, t.Dict[str, t.Any]],
+    write: bool = True,
+    strategy: CatalogMutationStrategy = CatalogMutationStrategy.PRUNE,
+    indent: t.Optional[int] = None,
+    output: t.Optional[Path] = None,
+) -> SingerCatalog:
+    """Applies the selected streams and attributes and then the metadata to the target catalog
+
+    This is equivalent to calling apply_selected and then apply_metadata, but the catalog
+    is only parsed and written once. If an output path is given the result is written there
+    instead of back to the target catalog, leaving the target untouched."""
+    catalog = apply_selected(target_catalog, selections, write=False, strategy=strategy)
+    catalog = apply_metadata(catalog, metadata, write=False)
+
+    if output is not None:
+        _write_catalog(output, catalog, indent=indent)
+    elif write and isinstance(target_catalog, Path):
+        _write_catalog(target_catalog, catalog, indent=indent)
 
     return catalog
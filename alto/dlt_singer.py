@@ -1,7 +1,8 @@
+import multiprocessing
 import os
 import typing as t
-from queue import Empty, Queue
-from threading import Thread
+from queue import Queue, SimpleQueue
+from threading import Event, Lock, Thread
 
 import alto.constants
 import alto.engine
@@ -12,6 +13,48 @@ try:
 except ImportError:
     raise ImportError("dlt is not installed. Please install dlt to use this module.")
 
+BATCH_SIZE = 1024
+"""The number of records to accumulate per stream before handing them to the consumer."""
+
+SETUP_TIMEOUT = 180.0
+"""The number of seconds to wait for the singer tap to start before giving up."""
+
+QUEUE_SIZE = int(os.getenv("ALTO_DLT_QUEUE_SIZE", "0"))
+"""The number of batches buffered per stream before the demuxer blocks, 0 is unbounded.
+
+Bounding the queues caps memory when dlt lags behind the tap. Only set this when dlt visits
+resources round robin, if it drains one resource at a time the demuxer can block on a full
+queue that nothing will read until the tap finishes.
+"""
+
+USE_PROCESS = os.getenv("ALTO_DLT_PROCESS") == "1"
+"""Whether to demux the tap output in a child process rather than a thread."""
+
+_FORK_SUPPORTED = "fork" in multiprocessing.get_all_start_methods()
+_MP_CONTEXT = multiprocessing.get_context("fork" if _FORK_SUPPORTED else None)
+
+
+class StateMerger(Thread):
+    """Merges the STATE messages emitted by a tap in the background.
+
+    The demuxer puts each STATE value on a channel read by this thread, so merging the
+    state tree never holds up the records. The channel is closed by a None.
+    """
+
+    def __init__(self, channel: t.Any) -> None:
+        """Initialize the state merger."""
+        super().__init__(daemon=True)
+        self.channel = channel
+        self.state: dict = {}
+
+    def run(self) -> None:
+        """Merge STATE values until the channel is closed."""
+        while True:
+            value = self.channel.get()
+            if value is None:
+                break
+            merge(value, self.state)
+
 
 class SingerTapDemux(Thread):
     """Singer taps output all records to a single stream.
@@ -20,8 +63,6 @@ class SingerTapDemux(Thread):
     each stream to be processed in parallel and dlt to manage each as a separate resource.
     """
 
-    daemon = True
-
     def __init__(
         self,
         tap: alto.engine.AltoPlugin,
@@ -33,43 +74,163 @@ class SingerTapDemux(Thread):
         super().__init__(daemon=True)
         self.tap = tap
         self.engine = engine
-        self.streams = {stream: Queue() for stream in streams}
+        self.streams = {
+            stream: Queue(maxsize=QUEUE_SIZE) if QUEUE_SIZE else SimpleQueue() for stream in streams
+        }
+        # STATE messages travel on their own channel so record queues only carry records
+        self.state = SimpleQueue()
+        self.state_merger = StateMerger(self.state)
+        self._state_lock = Lock()
+        self._state_drained = False
         self.init_state = init_state
         # Lifecycle flags
-        self.setup_complete = False
+        self.setup_complete = Event()
         self.graceful_exit = False
 
+    def start(self) -> None:
+        """Start the demuxer and the state merger fed by it."""
+        self.state_merger.start()
+        super().start()
+
     def run(self) -> None:
         """Run the demuxer thread."""
-        t = self.tap
-        e = self.engine
+        try:
+            self._run()
+        finally:
+            self._release()
+
+    def _release(self) -> None:
+        """Signal the end of the tap's output to everything waiting on the demuxer."""
+        # Unblock anyone waiting on setup even if the tap failed to start
+        self.setup_complete.set()
+        # Put a None on the state channel and each stream to signal the end of the stream
+        self.state.put(None)
+        for queue in self.streams.values():
+            queue.put(None)
+
+    def merge_state(self, state_dict: dict) -> None:
+        """Merge every STATE message emitted by the tap into the state dict.
+
+        This is called by each consumer at the end of its stream. It waits for the state
+        merger to see the None put on the channel when the demuxer exits, the first caller
+        then merges the accumulated state and later callers find it already merged.
+        """
+        self.state_merger.join()
+        with self._state_lock:
+            if not self._state_drained:
+                merge(self.state_merger.state, state_dict)
+                self._state_drained = True
+
+    def _run(self) -> None:
+        """Run the tap and demux its output."""
+        tap = self.tap
+        engine = self.engine
         with alto.engine.tap_runner(
-            t,
-            e.filesystem,
-            e.alto,
-            state_key=f"{t.name}-dlt",
+            tap,
+            engine.filesystem,
+            engine.alto,
+            state_key=f"{tap.name}-dlt",
             state_dict=self.init_state,
+            message_types=("RECORD", "STATE"),
         ) as tap_stream:
-            self.setup_complete = True
+            self.setup_complete.set()
+            # Records are handed over in batches to amortize the cost of each put
+            batches: t.Dict[str, t.List[dict]] = {stream: [] for stream in self.streams}
+            # Bind the puts once rather than resolving them for every message
+            puts = {stream: queue.put for stream, queue in self.streams.items()}
+            state_put = self.state.put
             for payload in tap_stream:
                 if payload is None:
                     continue
                 typ, maybe_stream, message = payload
                 stream: str
-                if typ == "STATE":
-                    stream = next(iter(self.streams.keys()))
-                    self.streams[stream].put((typ, message["value"]))
-                elif typ == "RECORD":
+                # RECORD is by far the most common message so it is tested first
+                if typ == "RECORD":
                     stream = maybe_stream
-                    self.streams[stream].put((typ, message["record"]))
-                elif typ == "SCHEMA":
-                    pass
-        # Put a None on each stream to signal the end of the stream
-        for queue in self.streams.values():
-            queue.put(None)
+                    batch = batches[stream]
+                    batch.append(message["record"])
+                    if len(batch) >= BATCH_SIZE:
+                        puts[stream](batch)
+                        batches[stream] = []
+                elif typ == "STATE":
+                    state_put(message["value"])
+            # Flush any partial batches
+            for stream, batch in batches.items():
+                if batch:
+                    puts[stream](batch)
         self.graceful_exit = True
 
 
+class SingerTapDemuxProcess(_MP_CONTEXT.Process):  # type: ignore
+    """A SingerTapDemux which runs in a forked child process.
+
+    Decoding the tap output is CPU bound, in a thread it competes for the GIL with every
+    dlt resource consuming the streams. Running it in a child process moves that work to
+    another core. Batches are pickled across process boundaries so this pays off for high
+    volume taps. Opt in by setting ALTO_DLT_PROCESS=1, this requires the fork start method.
+    The end of stream sentinels are put by the parent once the child has exited, so they
+    are sent exactly once however the child ends.
+    """
+
+    def __init__(
+        self,
+        tap: alto.engine.AltoPlugin,
+        engine: alto.engine.AltoTaskEngine,
+        init_state: dict,
+        *streams: str,
+    ) -> None:
+        """Initialize the demuxer."""
+        if not _FORK_SUPPORTED:
+            raise RuntimeError("ALTO_DLT_PROCESS requires the fork start method.")
+        super().__init__(daemon=True)
+        ctx = _MP_CONTEXT
+        self.tap = tap
+        self.engine = engine
+        # A Queue buffers puts in a feeder thread so a full pipe never blocks the child,
+        # only reaching QUEUE_SIZE does when it is set
+        self.streams = {stream: ctx.Queue(maxsize=QUEUE_SIZE) for stream in streams}
+        self.state = ctx.Queue()
+        self.state_merger = StateMerger(self.state)
+        self._state_lock = Lock()
+        self._state_drained = False
+        self.init_state = init_state
+        # Lifecycle flags, shared with the parent process
+        self.setup_complete = ctx.Event()
+        self._graceful_exit = ctx.Value("b", False)
+
+    @property
+    def graceful_exit(self) -> bool:
+        """Whether the child process ran the tap to completion."""
+        return bool(self._graceful_exit.value)
+
+    @graceful_exit.setter
+    def graceful_exit(self, value: bool) -> None:
+        self._graceful_exit.value = value
+
+    def start(self) -> None:
+        """Start the child process, the state merger and a thread which watches for it to die."""
+        super().start()
+        self.state_merger.start()
+        Thread(target=self._watch, daemon=True).start()
+
+    def _watch(self) -> None:
+        """Release the consumers once the child exits, whether it finished or was killed.
+
+        A child flushes what it put on the queues before it exits, so the sentinels always
+        follow its last batch.
+        """
+        self.join()
+        self._release()
+
+    def run(self) -> None:
+        """Run the demuxer in the child process."""
+        self._run()
+
+    _run = SingerTapDemux._run
+    _release = SingerTapDemux._release
+    merge_state = SingerTapDemux.merge_state
+
+
 def singer(name: str, **kwargs) -> t.Callable[..., t.Sequence[t.Any]]:
     """Factory for creating a dlt.source function for a singer tap."""
 
@@ -107,8 +268,11 @@ def singer(name: str, **kwargs) -> t.Callable[..., t.Sequence[t.Any]]:
                 )
         # Create the demuxer
         tap.select = streams
-        producer = SingerTapDemux(tap, engine, dlt.state().setdefault(tap.name, {}), *streams)
+        demux = SingerTapDemuxProcess if USE_PROCESS else SingerTapDemux
+        producer = demux(tap, engine, dlt.state().setdefault(tap.name, {}), *streams)
         producer.start()
+        if not producer.setup_complete.wait(timeout=SETUP_TIMEOUT):
+            raise RuntimeError(f"Singer tap {tap.name} did not start within {SETUP_TIMEOUT}s.")
         # Use the catalog to determine some resource props
         for stream in streams:
             opts: dict = resource_options.setdefault(stream, {})
@@ -136,28 +300,24 @@ def singer(name: str, **kwargs) -> t.Callable[..., t.Sequence[t.Any]]:
 
 def singer_stream_factory(
     stream: str, resource_options: t.Dict[str, t.Any]
-) -> t.Callable[[Queue], t.Iterator[t.Any]]:
+) -> t.Callable[..., t.Iterator[t.Any]]:
     """Factory for creating a dlt.resource function for each stream."""
 
     @dlt.resource(name=stream, **resource_options)
-    def _singer_stream(_queue: Queue, producer: SingerTapDemux) -> t.Iterator[t.Any]:
+    def _singer_stream(
+        _queue: t.Union[Queue, SimpleQueue],
+        producer: t.Union[SingerTapDemux, SingerTapDemuxProcess],
+    ) -> t.Iterator[t.Any]:
         state_dict = dlt.state().setdefault(producer.tap.name, {})
-        poll_interval = 1
-        while producer.is_alive() or not _queue.empty():
-            try:
-                item = _queue.get(timeout=poll_interval)
-            except Empty:
-                continue
-            else:
-                if item is None:
-                    _queue.task_done()
-                    break  # End of stream
-                typ, message = item
-                if typ == "STATE":
-                    merge(message, state_dict)
-                elif typ == "RECORD":
-                    yield message
-                _queue.task_done()
+        get = _queue.get
+        # The producer always puts a None on exit, so a blocking get cannot hang
+        while True:
+            batch = get()
+            if batch is None:
+                break  # End of stream
+            # A list of records is treated by dlt as a single page
+            yield batch
+        producer.merge_state(state_dict)
         if not producer.graceful_exit:
             raise RuntimeError("Singer tap exited unexpectedly.")
 
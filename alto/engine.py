@@ -14,6 +14,7 @@
 import atexit
 import datetime
 import fnmatch
+import functools
 import gzip
 import io
 import itertools
@@ -24,11 +25,13 @@ import queue
 import shutil
 import subprocess
 import sys
+import tempfile
 import threading
+import time
 import typing as t
 import uuid
+from collections import deque
 from contextlib import contextmanager
-from copy import deepcopy
 from enum import Enum
 from hashlib import md5, sha1
 from pathlib import Path
@@ -43,7 +46,7 @@ from doit.tools import config_changed
 from dynaconf.utils.boxing import DynaBox
 from fsspec.implementations.dirfs import DirFileSystem
 
-from alto.catalog import apply_metadata, apply_selected
+from alto.catalog import apply_selected_and_metadata
 from alto.constants import (
     ALTO_DB_FILE,
     ALTO_ROOT,
@@ -70,9 +73,22 @@ from alto.utils import (
     load_extension_from_spec,
     load_mapper_from_path,
     merge,
+    message_type,
 )
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    from isal import igzip as gzip_impl
+except ImportError:
+    gzip_impl = gzip
+
 if t.TYPE_CHECKING:
+    from concurrent.futures import Future, ThreadPoolExecutor
+
     from dynaconf import Dynaconf, Validator
 
 __all__ = [
@@ -86,6 +102,20 @@ RESERVOIR_VERSION_KEY = "__version__"
 """The key used to store the version of the reservoir format."""
 RESERVOIR_BUFFER_SIZE = 10_000
 """The default number of records to buffer before flushing to reservoir filesystem."""
+RESERVOIR_SPOOL_SIZE = 8 << 20
+"""The compressed bytes a reservoir buffer holds in memory before it spills to disk."""
+STATE_WRITE_INTERVAL = 0.5
+"""The minimum number of seconds between state file rewrites triggered by STATE messages."""
+RESERVOIR_PREFETCH = 8
+"""The number of reservoir files downloaded ahead of the one being emitted to a target."""
+RESERVOIR_COMPRESSLEVEL = 1
+"""The gzip level of reservoir files, the fastest level valid for both isal and zlib."""
+PIPE_READ_SIZE = 1 << 16
+"""The maximum number of bytes a pipe logger reads from a plugin's stderr at once."""
+PARALLEL_LOAD = os.getenv("ALTO_PARALLEL_LOAD") == "1"
+"""Whether to generate the builtin task groups concurrently when loading tasks."""
+_PLATFORM_KEY = "".join((platform.python_version(), platform.machine(), platform.system()))
+"""The interpreter and platform a pex is built for, part of the pex cache key."""
 
 
 def find_hyphen_key(key: str, data: t.Dict[str, t.Any]) -> t.Optional[str]:
@@ -132,12 +162,38 @@ class AltoConfiguration:
     def __init__(self, inner: DynaBox) -> None:
         """Initialize the alto config container."""
         self._inner = inner
+        self._plugins_by_type: t.Optional[t.Dict[PluginType, t.Dict[str, "AltoPlugin"]]] = None
+        self._all_plugins: t.Dict[str, "AltoPlugin"] = {}
+        self._name_index: t.Optional[t.Dict[str, t.Tuple[PluginType, DynaBox]]] = None
+        self._spec_cache: t.Dict[str, DynaBox] = {}
 
     @property
     def inner(self) -> DynaBox:
         """Return the underlying dynaconf config object."""
         return self._inner
 
+    def _plugin_index(self) -> t.Dict[PluginType, t.Dict[str, "AltoPlugin"]]:
+        """Return the plugins keyed by type and name, building them on first access.
+
+        The plugins are shared by every caller and must not be mutated, use make_plugins
+        for plugins which can be.
+        """
+        if self._plugins_by_type is None:
+            plugins_by_type = {
+                typ: {
+                    name: AltoPlugin(name, typ=typ, config=self)
+                    for name in self.inner.get(typ.value, {})
+                }
+                for typ in (PluginType.TAP, PluginType.TARGET, PluginType.UTILITY)
+            }
+            all_plugins: t.Dict[str, AltoPlugin] = {}
+            for named in plugins_by_type.values():
+                for name, plugin in named.items():
+                    # The first type a name appears under wins
+                    all_plugins.setdefault(name, plugin)
+            self._plugins_by_type, self._all_plugins = plugins_by_type, all_plugins
+        return self._plugins_by_type
+
     def plugins(self, *types: PluginType) -> t.List["AltoPlugin"]:
         """Return a list of 2-tuples of plugins and their configuration object.
 
@@ -147,11 +203,8 @@ class AltoConfiguration:
         """
         if not types:
             types = (PluginType.TAP, PluginType.TARGET, PluginType.UTILITY)
-        return [
-            AltoPlugin(name, typ=typ, config=self)
-            for typ in types
-            for name in self.inner.get(typ.value, {})
-        ]
+        index = self._plugin_index()
+        return [plugin for typ in types for plugin in index[typ].values()]
 
     def get_plugin(self, name: str) -> "AltoPlugin":
         """Return a plugin by name.
@@ -159,49 +212,78 @@ class AltoConfiguration:
         Args:
             name: The name of the plugin to return.
         """
-        for plugin in self.plugins():
-            if plugin.name == name:
-                return plugin
-        raise ValueError(f"Plugin {name} not found")
+        self._plugin_index()
+        try:
+            return self._all_plugins[name]
+        except KeyError:
+            raise ValueError(f"Plugin {name} not found")
 
     @property
     def taps(self):
         """Return a dictionary of tap plugins."""
-        return {plugin.name: plugin for plugin in self.plugins(PluginType.TAP)}
+        return dict(self._plugin_index()[PluginType.TAP])
 
     @property
     def targets(self):
         """Return a dictionary of target plugins."""
-        return {plugin.name: plugin for plugin in self.plugins(PluginType.TARGET)}
+        return dict(self._plugin_index()[PluginType.TARGET])
 
     @property
     def utilities(self):
         """Return a dictionary of utility plugins."""
-        return {plugin.name: plugin for plugin in self.plugins(PluginType.UTILITY)}
+        return dict(self._plugin_index()[PluginType.UTILITY])
 
     def spec_for(self, name: str) -> DynaBox:
         """Return the top level data for a plugin from alto config.
 
-        This method will recursively merge the plugin's spec with its parent's spec.
+        This method will merge the plugin's spec with the specs of its ancestors.
 
         Args:
             name: The name of the plugin to return the spec for.
         """
-        spec = next(
-            (
-                plugin_spec
-                for typ in (PluginType.TAP, PluginType.TARGET, PluginType.UTILITY)
-                for plugin_name, plugin_spec in self.inner.get(typ.value, {}).items()
-                if plugin_name == name
-            ),
-            None,
-        )
-        if spec is None:
-            raise ValueError(f"Plugin {name} not found")
-        if "inherit_from" in spec:
-            layer = self.spec_for(spec["inherit_from"])
-            spec = layer + spec
-        return spec
+        if name in self._spec_cache:
+            return self._spec_cache[name]
+        if self._name_index is None:
+            name_index: t.Dict[str, t.Tuple[PluginType, DynaBox]] = {}
+            for typ in (PluginType.TAP, PluginType.TARGET, PluginType.UTILITY):
+                for plugin_name, plugin_spec in self.inner.get(typ.value, {}).items():
+                    # The first type a name appears under wins
+                    name_index.setdefault(plugin_name, (typ, plugin_spec))
+            self._name_index = name_index
+        # Walk up the inherit_from chain until a cached spec or a root plugin
+        chain: t.List[t.Tuple[str, DynaBox]] = []
+        seen: t.Set[str] = set()
+        layer: t.Optional[DynaBox] = None
+        ancestor: t.Optional[str] = name
+        while ancestor is not None:
+            if ancestor in self._spec_cache:
+                layer = self._spec_cache[ancestor]
+                break
+            if ancestor in seen:
+                raise ValueError(f"Plugin {name} has a circular inherit_from chain")
+            seen.add(ancestor)
+            try:
+                _, spec = self._name_index[ancestor]
+            except KeyError:
+                raise ValueError(f"Plugin {ancestor} not found")
+            chain.append((ancestor, spec))
+            ancestor = spec.get("inherit_from")
+        # Then merge back down, caching each spec on the way
+        for ancestor, spec in reversed(chain):
+            if layer is not None:
+                spec = layer + spec
+            self._spec_cache[ancestor] = layer = spec
+        return layer
+
+
+@functools.lru_cache(maxsize=4)
+def _dir_filesystem(root: str, protocol: str, settings: str) -> DirFileSystem:
+    """Return the storage file system rooted at a path, shared by every engine in the process.
+
+    This keeps connection pools and resolved credentials alive across engines. The settings
+    are passed as a JSON string so they can be part of the cache key.
+    """
+    return DirFileSystem(root, fs=fsspec.filesystem(protocol, **json.loads(settings)))
 
 
 class AltoFileSystem:
@@ -220,6 +302,16 @@ class AltoFileSystem:
         """
         self._root_dir = root_dir
         self._config = config
+        self._listings: t.Dict[str, t.Set[str]] = {}
+        # Remote paths with an upload in flight, background uploads update the listings so
+        # both are guarded by the same lock
+        self._uploads: t.Dict[str, "Future"] = {}
+        self._listings_lock = threading.Lock()
+        self._made_dirs: t.Set[str] = set()
+        self._local_paths: t.Dict[t.Tuple[str, str, str], str] = {}
+        # Guards lazy attributes which must only be created once, tasks may be generated
+        # and run on several threads
+        self._init_lock = threading.RLock()
 
     @property
     def root_dir(self) -> Path:
@@ -250,19 +342,35 @@ class AltoFileSystem:
         The staging directory is where alto persists data during the execution of a task.
         """
         if not hasattr(self, "_stg_dir"):
-            tmp = self.root_dir.joinpath(ALTO_ROOT, os.urandom(4).hex())
-            tmp.mkdir(parents=True, exist_ok=True)
+            with self._init_lock:
+                if not hasattr(self, "_stg_dir"):
+                    tmp = self.root_dir.joinpath(ALTO_ROOT, os.urandom(4).hex())
+                    tmp.mkdir(parents=True, exist_ok=True)
+                    self._stg_dir = tmp
+                    # Register a cleanup function to remove the staging directory
+                    atexit.register(self._remove_stg_dir)
+        return self._stg_dir
 
-            def cleanup():
-                try:
-                    shutil.rmtree(tmp)
-                except FileNotFoundError:
-                    pass
+    def _remove_stg_dir(self) -> None:
+        """Remove the staging directory and forget the directories created below it."""
+        tmp = self._stg_dir
+        resolved = str(tmp.resolve())
+        try:
+            shutil.rmtree(tmp)
+        except FileNotFoundError:
+            pass
+        self._forget_local_dir(resolved)
 
-            # Register a cleanup function to remove the staging directory
-            atexit.register(cleanup)
-            self._stg_dir = tmp
-        return self._stg_dir
+    @property
+    def _env_dirs(self) -> t.Tuple[str, str]:
+        """Return the state and log directories for the current environment.
+
+        The environment is fixed for the life of an engine so these are only formatted once.
+        """
+        if not hasattr(self, "_state_log_dirs"):
+            env = self.config.current_env
+            self._state_log_dirs = (STATE_DIR.format(env=env), LOG_DIR.format(env=env))
+        return self._state_log_dirs
 
     @property
     def config(self) -> DynaBox:
@@ -276,27 +384,124 @@ class AltoFileSystem:
         The alto storage file system is used to persist data to a remote storage location.
         """
         if not hasattr(self, "_fs"):
-            fsystem: str = str(self.config.get("FILESYSTEM", "FILE")).upper()
-            if fsystem == "FILE":
-                # Local file system
-                self._fs = DirFileSystem(
-                    self.sys_dir, fs=fsspec.filesystem(fsystem.lower(), auto_mkdir=True)
-                )
-            elif fsystem in ("S3", "S3A", "GS", "GCS", "ADLS"):
-                # Remote file system
-                path: str = self.config.get("BUCKET_PATH", "alto")
-                path = path.strip("/")
-                self._fs = DirFileSystem(
-                    f"{self.config['BUCKET']}/{path}/{self.config['PROJECT_NAME']}",
-                    fs=fsspec.filesystem(
-                        fsystem.lower(), **self.config.get(f"{fsystem}_SETTINGS", DynaBox())
-                    ),
-                )
-            else:
-                # Invalid file system
-                raise ValueError(f"Invalid filesystem type specified. Got: {fsystem}")
+            with self._init_lock:
+                if not hasattr(self, "_fs"):
+                    self._fs = self._make_fs()
         return self._fs
 
+    def _make_fs(self) -> fsspec.AbstractFileSystem:
+        """Create the alto storage file system from the configuration."""
+        fsystem: str = str(self.config.get("FILESYSTEM", "FILE")).upper()
+        if fsystem == "FILE":
+            # Local file system
+            return _dir_filesystem(self.sys_dir, fsystem.lower(), json.dumps({"auto_mkdir": True}))
+        elif fsystem in ("S3", "S3A", "GS", "GCS", "ADLS"):
+            # Remote file system
+            path: str = self.config.get("BUCKET_PATH", "alto")
+            path = path.strip("/")
+            settings = self.config.get(f"{fsystem}_SETTINGS", DynaBox())
+            return _dir_filesystem(
+                f"{self.config['BUCKET']}/{path}/{self.config['PROJECT_NAME']}",
+                fsystem.lower(),
+                json.dumps(settings.to_dict(), sort_keys=True),
+            )
+        else:
+            # Invalid file system
+            raise ValueError(f"Invalid filesystem type specified. Got: {fsystem}")
+
+    def _listing(self, parent: str) -> t.Set[str]:
+        """Return the names of the files in a remote directory, listing it only once."""
+        with self._listings_lock:
+            listing = self._listings.get(parent)
+        if listing is None:
+            try:
+                paths = self.fs.ls(parent, detail=False)
+            except FileNotFoundError:
+                paths = []
+            with self._listings_lock:
+                # Another thread may have listed the directory meanwhile, keep its set so
+                # the names it has added since are not lost
+                listing = self._listings.setdefault(
+                    parent, {path.rstrip("/").rpartition("/")[2] for path in paths}
+                )
+        return listing
+
+    def _track_upload(self, remote: str, future: "Future") -> None:
+        """Remember an upload in flight so reads of the same path can wait for it."""
+
+        def done(_: "Future") -> None:
+            with self._listings_lock:
+                if self._uploads.get(remote) is future:
+                    del self._uploads[remote]
+
+        with self._listings_lock:
+            self._uploads[remote] = future
+        future.add_done_callback(done)
+
+    def _join_upload(self, remote: str) -> None:
+        """Wait for an upload of a remote path which is still in flight."""
+        with self._listings_lock:
+            future = self._uploads.get(remote)
+        if future is not None:
+            from concurrent.futures import wait
+
+            # A failed upload is raised by wait_for_uploads, the read just sees no file
+            wait([future])
+
+    def remote_exists(self, path: str) -> bool:
+        """Return whether a file exists in the alto storage directory.
+
+        The parent directory is listed once and remembered, so probing many files in the same
+        directory costs a single round trip rather than one per file. Files must be added and
+        removed through `put` and `delete` for the listing to stay accurate. An upload of the
+        path which is still in flight is waited for first.
+
+        Args:
+            path: The remote path of the file.
+        """
+        self._join_upload(path)
+        parent, _, name = path.rpartition("/")
+        listing = self._listing(parent)
+        with self._listings_lock:
+            return name in listing
+
+    def put(self, local: str, remote: str) -> None:
+        """Upload a file to the alto storage directory.
+
+        Args:
+            local: The local path of the file.
+            remote: The remote path of the file.
+        """
+        self.fs.put(local, remote)
+        parent, _, name = remote.rpartition("/")
+        with self._listings_lock:
+            if parent in self._listings:
+                self._listings[parent].add(name)
+
+    def get(self, remote: str, local: str) -> None:
+        """Download a file from the alto storage directory.
+
+        An upload of the path which is still in flight is waited for first.
+
+        Args:
+            remote: The remote path of the file.
+            local: The local path of the file.
+        """
+        self._join_upload(remote)
+        self.fs.get(remote, local)
+
+    def delete(self, remote: str) -> None:
+        """Delete a file from the alto storage directory.
+
+        Args:
+            remote: The remote path of the file.
+        """
+        self.fs.delete(remote)
+        parent, _, name = remote.rpartition("/")
+        with self._listings_lock:
+            if parent in self._listings:
+                self._listings[parent].discard(name)
+
     def _remote_path(self, fname: str, key: str = "/") -> str:
         """Return the path to a file in the alto storage directory.
 
@@ -306,6 +511,42 @@ class AltoFileSystem:
         """
         return "/".join([key, fname]).lstrip("/")
 
+    def _local_path(self, base: str, fname: str, key: str) -> str:
+        """Return a path below a local base directory, creating its parent if necessary.
+
+        Resolved paths and created parents are remembered so the same plugin paths, which
+        every task generator asks for, are only normalized and created once.
+
+        Args:
+            base: The absolute base directory.
+            fname: The name of the file.
+            key: The key to the file.
+        """
+        cache_key = (base, key, fname)
+        path = self._local_paths.get(cache_key)
+        if path is None:
+            path = os.path.normpath(os.path.join(base, key, fname))
+            parent = os.path.dirname(path)
+            if parent not in self._made_dirs:
+                os.makedirs(parent, exist_ok=True)
+                self._made_dirs.add(parent)
+            self._local_paths[cache_key] = path
+        return path
+
+    def _forget_local_dir(self, path: str) -> None:
+        """Forget the directories created and paths resolved below a removed local directory.
+
+        Args:
+            path: The absolute path of the removed directory.
+        """
+        prefix = os.path.join(path, "")
+        self._made_dirs.difference_update(
+            [made for made in self._made_dirs.copy() if made == path or made.startswith(prefix)]
+        )
+        for cache_key, cached in self._local_paths.copy().items():
+            if cached.startswith(prefix):
+                self._local_paths.pop(cache_key, None)
+
     def _temp_path(self, fname: str, key: str = "./") -> str:
         """Return the path to a file in the staging directory.
 
@@ -313,9 +554,9 @@ class AltoFileSystem:
             fname: The name of the file.
             key: The key to the file.
         """
-        path = Path(self.stg_dir).joinpath(key, fname).resolve()
-        path.parent.mkdir(parents=True, exist_ok=True)
-        return str(path)
+        if not hasattr(self, "_abs_stg_dir"):
+            self._abs_stg_dir = str(Path(self.stg_dir).resolve())
+        return self._local_path(self._abs_stg_dir, fname, key)
 
     def _root_path(self, fname: str, key: str = "./") -> str:
         """Return the path to a file in the root .alto directory.
@@ -324,9 +565,9 @@ class AltoFileSystem:
             fname: The name of the file.
             key: The key to the file.
         """
-        path = Path(self.root_dir).joinpath(ALTO_ROOT, key, fname).resolve()
-        path.parent.mkdir(parents=True, exist_ok=True)
-        return str(path)
+        if not hasattr(self, "_abs_alto_dir"):
+            self._abs_alto_dir = str(Path(self.root_dir).joinpath(ALTO_ROOT).resolve())
+        return self._local_path(self._abs_alto_dir, fname, key)
 
     def executable_path(self, fname: str, remote: bool = False) -> str:
         """Return the path to the PEX executable for a plugin.
@@ -366,9 +607,7 @@ class AltoFileSystem:
             remote: Whether or not the path should be in the remote storage directory.
         """
         getter = self._remote_path if remote else self._temp_path
-        return getter(
-            fname=f"{tap}-to-{target}.json", key=STATE_DIR.format(env=self.config.current_env)
-        )
+        return getter(fname=f"{tap}-to-{target}.json", key=self._env_dirs[0])
 
     def base_catalog_path(self, name: str, remote: bool = False) -> str:
         """Return the path to the base catalog for a plugin.
@@ -400,7 +639,7 @@ class AltoFileSystem:
             remote: Whether or not the path should be in the remote storage directory.
         """
         getter = self._remote_path if remote else self._root_path
-        return getter(fname=fname, key=LOG_DIR.format(env=self.config.current_env))
+        return getter(fname=fname, key=self._env_dirs[1])
 
 
 class AltoPlugin:
@@ -512,12 +751,27 @@ class AltoPlugin:
         self._select = (value or ["*.*"]) + [
             rule for rule in self.select if rule.startswith("~") and self._retain_hash_rules
         ]
+        # The select feeds the apply fingerprint
+        self.__dict__.pop("apply_fingerprint", None)
 
     @property
     def metadata(self) -> t.Dict[str, t.Any]:
         """Return the select for the plugin."""
         return self.spec.get("metadata", {})
 
+    @functools.cached_property
+    def apply_fingerprint(self) -> str:
+        """Return a digest of the select and metadata applied to the plugin's catalog.
+
+        This lets doit detect a change in the rules by comparing a short string.
+        """
+        rules = json.dumps(
+            {"select": self.select, "metadata": self.metadata},
+            sort_keys=True,
+            separators=(",", ":"),
+        )
+        return md5(rules.encode("utf-8")).hexdigest()
+
     @property
     def entrypoint(self) -> str:
         """Return the entrypoint for the plugin."""
@@ -533,23 +787,28 @@ class AltoPlugin:
             **self.spec.get("environment", {}),
         }
 
+    @functools.cached_property
+    def process_env(self) -> t.Dict[str, str]:
+        """Return the full environment a subprocess of the plugin runs with.
+
+        This is built on first use, after the engine has applied its environment to
+        os.environ, and shared by every process spawned for the plugin. Do not mutate it.
+        """
+        return {**os.environ, **self.environment}
+
     def config_relative_to(self, other: "AltoPlugin") -> DynaBox:
         """Return the config for the plugin."""
         return self.config + other.spec.get(self.name, DynaBox())
 
-    @property
+    @functools.cached_property
     def pex_name(self) -> str:
         """Return the unique name for the pex executable.
 
-        This is used to cache the pex and reuse it across runs and machines.
+        This is used to cache the pex and reuse it across runs and machines. The spec a
+        plugin is built from does not change after init so the name is computed once.
         """
-        pex_hash = sha1(self.pip_url.strip().encode("utf-8"))
-        pex_hash.update(platform.python_version().encode("utf-8"))
-        pex_hash.update(platform.machine().encode("utf-8"))
-        pex_hash.update(platform.system().encode("utf-8"))
-        if self.cache_version:
-            pex_hash.update(self.cache_version.encode("utf-8"))
-        return pex_hash.hexdigest()
+        key = self.pip_url.strip() + _PLATFORM_KEY + (self.cache_version or "")
+        return sha1(key.encode("utf-8")).hexdigest()
 
     def get_stream_maps(self, filesystem: AltoFileSystem) -> t.List["AltoStreamMap"]:
         """Return the stream maps for the plugin."""
@@ -873,14 +1132,24 @@ class AltoTaskEngine(DoitEngine):
                 root_dir.glob("alto.*.json"),
                 root_dir.glob("alto.*.yaml"),
             )
-            # Load the configuration
+            # Load the configuration, only passing files which exist as dynaconf
+            # runs its full loader for every candidate it is given
             self.alto = Dynaconf(
                 settings_files=[
-                    root_dir.joinpath(f"alto.{fmt}") for fmt in SUPPORTED_CONFIG_FORMATS
+                    path
+                    for path in (
+                        root_dir.joinpath(f"alto.{fmt}") for fmt in SUPPORTED_CONFIG_FORMATS
+                    )
+                    if path.is_file()
                 ],
                 includes=[str(s) for s in stack if s.is_file() and "secrets" not in s.name],
                 secrets=[
-                    root_dir.joinpath(f"alto.secrets.{fmt}") for fmt in SUPPORTED_CONFIG_FORMATS
+                    path
+                    for path in (
+                        root_dir.joinpath(f"alto.secrets.{fmt}")
+                        for fmt in SUPPORTED_CONFIG_FORMATS
+                    )
+                    if path.is_file()
                 ],
                 **kwargs,
             )
@@ -1008,7 +1277,24 @@ class AltoTaskEngine(DoitEngine):
     def task_build(self) -> AltoTaskGenerator:
         """[core] Generate pex plugin based on the alto config."""
 
-        for plugin in self.configuration.plugins():
+        plugins = self.configuration.plugins()
+        # Yield the plugins most tasks wait on first, doit starts them in this order so they
+        # leave the critical path early. Those are the parents of other plugins and the
+        # plugins feeding the most pipelines.
+        dependents: t.Dict[str, int] = {}
+        for plugin in plugins:
+            parent = plugin.spec.get("inherit_from")
+            if parent:
+                dependents[parent] = dependents.get(parent, 0) + 1
+        pipelines = {
+            PluginType.TAP: len(self.configuration.plugins(PluginType.TARGET)),
+            PluginType.TARGET: len(self.configuration.plugins(PluginType.TAP)),
+        }
+        plugins.sort(
+            key=lambda plugin: dependents.get(plugin.name, 0) + pipelines.get(plugin.type, 0),
+            reverse=True,
+        )
+        for plugin in plugins:
             # Skip plugins that do not have a pip_url
             if not plugin.pip_url:
                 continue
@@ -1019,6 +1305,8 @@ class AltoTaskEngine(DoitEngine):
                     task.set_actions((build_pex, (plugin, self.filesystem)))
                     .set_uptodate((maybe_get_pex, (plugin, self.filesystem)))
                     .set_clean((maybe_remove_pex, (plugin, self.filesystem)))
+                    # doit runs teardowns once every task is done, so uploads overlap builds
+                    .set_teardown((wait_for_uploads,))
                 )
             else:
                 # If the plugin inherits from another plugin, just ensure the parent is built
@@ -1029,7 +1317,9 @@ class AltoTaskEngine(DoitEngine):
         """[core] Generate configuration files on disk."""
 
         config_lock = threading.Lock()
-        for plugin in self.configuration.plugins(PluginType.TAP, PluginType.TARGET):
+        taps = self.configuration.plugins(PluginType.TAP)
+        targets = self.configuration.plugins(PluginType.TARGET)
+        for plugin in itertools.chain(taps, targets):
             yield (
                 AltoTask(name=plugin.name)
                 .set_actions((render_config, (plugin, config_lock, self.alto, self.filesystem)))
@@ -1039,10 +1329,7 @@ class AltoTaskEngine(DoitEngine):
             )
 
         # Tap Aware Combinatorial Configs
-        for tap, target in itertools.product(
-            self.configuration.plugins(PluginType.TAP),
-            self.configuration.plugins(PluginType.TARGET),
-        ):
+        for tap, target in itertools.product(taps, targets):
             yield (
                 AltoTask(name=f"{target}--{tap}")
                 .set_actions(
@@ -1082,7 +1369,7 @@ class AltoTaskEngine(DoitEngine):
                 .set_task_dep(f"{AltoCmd.CATALOG}:{tap}")
                 .set_uptodate(
                     Path(self.filesystem.catalog_path(tap.name)).exists,
-                    config_changed({"select": tap.select, "metadata": tap.metadata}),
+                    config_changed(tap.apply_fingerprint),
                 )
                 .set_doc(f"Render runtime catalog for {tap}")
                 .data
@@ -1109,11 +1396,13 @@ class AltoTaskEngine(DoitEngine):
     def task_pipeline(self) -> AltoTaskGenerator:
         """[singer] Execute a data pipeline."""
 
+        taps = self.configuration.plugins(PluginType.TAP)
+        targets = self.configuration.plugins(PluginType.TARGET)
+        # Settings lookups go through dynaconf, read them once for every task
+        env = self.alto.current_env
+        buffer_size = self.alto.get("RESERVOIR_BUFFER_SIZE", RESERVOIR_BUFFER_SIZE)
         # Combinatorial product of all taps and targets
-        for tap, target in itertools.product(
-            self.configuration.plugins(PluginType.TAP),
-            self.configuration.plugins(PluginType.TARGET),
-        ):
+        for tap, target in itertools.product(taps, targets):
             # Tap -> Target
             pipeline_id = uuid.uuid4()
             yield (
@@ -1146,10 +1435,7 @@ class AltoTaskEngine(DoitEngine):
                 .data
             )
 
-        for tap, target in itertools.product(
-            self.configuration.plugins(PluginType.TAP),
-            self.configuration.plugins(PluginType.TARGET),
-        ):
+        for tap, target in itertools.product(taps, targets):
             # Reservoir[Tap] -> Target
             pipeline_id = uuid.uuid4()
             tap_reservoir = tap.name.replace("tap", "reservoir")
@@ -1160,7 +1446,7 @@ class AltoTaskEngine(DoitEngine):
                     (get_remote_state, (tap_reservoir, target.name, self.filesystem, True)),
                     (
                         reservoir_to_target,
-                        (tap, target, pipeline_id, self.filesystem, self.alto.current_env),
+                        (tap, target, pipeline_id, self.filesystem, env),
                     ),
                 )
                 .set_task_dep(f"{AltoCmd.BUILD}:{target}")
@@ -1183,7 +1469,7 @@ class AltoTaskEngine(DoitEngine):
                 .data
             )
 
-        for tap in self.configuration.plugins(PluginType.TAP):
+        for tap in taps:
             # Tap -> Reservoir
             pipeline_id = uuid.uuid4()
             target = "reservoir"
@@ -1194,13 +1480,7 @@ class AltoTaskEngine(DoitEngine):
                     (get_remote_state, (tap.name, target, self.filesystem, tap.supports_state)),
                     (
                         tap_to_reservoir,
-                        (
-                            tap,
-                            pipeline_id,
-                            self.filesystem,
-                            self.alto.current_env,
-                            self.alto.get("RESERVOIR_BUFFER_SIZE", RESERVOIR_BUFFER_SIZE),
-                        ),
+                        (tap, pipeline_id, self.filesystem, env, buffer_size),
                     ),
                 )
                 .set_task_dep(f"{AltoCmd.BUILD}:{tap}", f"{AltoCmd.APPLY}:{tap}")
@@ -1232,16 +1512,39 @@ class AltoTaskEngine(DoitEngine):
             )
 
     def load_tasks(self, cmd: AltoCmdBase, pos_args) -> t.List[AltoTaskData]:
-        """Loads Alto tasks."""
+        """Loads Alto tasks.
+
+        The builtin task groups are independent of one another, so they are generated on a
+        thread pool when ALTO_PARALLEL_LOAD=1. Extensions are always loaded in order after
+        them as they may depend on state shared with the engine.
+        """
+        builtins = (
+            (AltoCmd.BUILD, self.task_build),
+            (AltoCmd.CONFIG, self.task_config),
+            (AltoCmd.CATALOG, self.task_catalog),
+            (AltoCmd.APPLY, self.task_apply),
+            (AltoCmd.PIPELINE, self.task_pipeline),
+            (AltoCmd.TEST, self.task_test),
+            (AltoCmd.ABOUT, self.task_about),
+        )
+
+        def _generate(builtin: t.Tuple[str, t.Callable[[], AltoTaskGenerator]]) -> list:
+            name, gen = builtin
+            return generate_tasks(name, gen(), gen.__doc__)
+
+        if PARALLEL_LOAD:
+            from concurrent.futures import ThreadPoolExecutor
+
+            # Build the shared lazy state up front rather than letting the threads race to it
+            self.configuration.plugins()
+            self.filesystem.stg_dir, self.filesystem._env_dirs, self.filesystem.fs
+            with ThreadPoolExecutor(max_workers=len(builtins)) as tpe:
+                tasks = list(tpe.map(_generate, builtins))
+        else:
+            tasks = list(map(_generate, builtins))
         return list(
             itertools.chain(
-                generate_tasks(AltoCmd.BUILD, self.task_build(), self.task_build.__doc__),
-                generate_tasks(AltoCmd.CONFIG, self.task_config(), self.task_config.__doc__),
-                generate_tasks(AltoCmd.CATALOG, self.task_catalog(), self.task_catalog.__doc__),
-                generate_tasks(AltoCmd.APPLY, self.task_apply(), self.task_apply.__doc__),
-                generate_tasks(AltoCmd.PIPELINE, self.task_pipeline(), self.task_pipeline.__doc__),
-                generate_tasks(AltoCmd.TEST, self.task_test(), self.task_test.__doc__),
-                generate_tasks(AltoCmd.ABOUT, self.task_about(), self.task_about.__doc__),
+                *tasks,
                 *(
                     generate_tasks(ext.name, ext.tasks(), f"[extension] {ext.__doc__}")
                     for ext in self.extensions
@@ -1288,13 +1591,76 @@ def map_worker(
 # ==================== #
 
 
-def pipe_logger(stream: t.IO[bytes], path: str, lock: threading.Lock) -> None:
-    """Log a stream to the console."""
+class _ConsoleDrain(threading.Thread):
+    """Echoes the lines of every pipe logger to the console from a single thread.
+
+    Loggers hand their lines over a queue instead of contending for a lock around each
+    print, and the lines which queue up while the console is busy are written together
+    with a single flush. An Event on the queue is set once everything before it is written.
+    """
+
+    max_batch = 1024
+
+    def __init__(self) -> None:
+        """Initialize the console drain."""
+        super().__init__(daemon=True)
+        self.lines: "queue.SimpleQueue[t.Union[str, threading.Event]]" = queue.SimpleQueue()
+
+    def run(self) -> None:
+        """Write queued lines to the console for the life of the process."""
+        get, get_nowait = self.lines.get, self.lines.get_nowait
+        while True:
+            batch = [get()]
+            try:
+                while len(batch) < self.max_batch:
+                    batch.append(get_nowait())
+            except queue.Empty:
+                pass
+            text = [item for item in batch if isinstance(item, str)]
+            if text:
+                sys.stdout.write("".join(text))
+                sys.stdout.flush()
+            for item in batch:
+                if isinstance(item, threading.Event):
+                    item.set()
+
+
+_CONSOLE_DRAIN: t.Optional[_ConsoleDrain] = None
+_CONSOLE_DRAIN_LOCK = threading.Lock()
+
+
+def pipe_logger(stream: t.IO[bytes], path: str) -> None:
+    """Log a stream to a file and echo it to the console.
+
+    Returns once the whole stream has been echoed, so joining the logger thread means its
+    output is on the console.
+    """
+    global _CONSOLE_DRAIN
+    with _CONSOLE_DRAIN_LOCK:
+        if _CONSOLE_DRAIN is None:
+            _CONSOLE_DRAIN = _ConsoleDrain()
+            _CONSOLE_DRAIN.start()
+    echo = _CONSOLE_DRAIN.lines.put
+    # Read whatever the pipe holds rather than a line at a time, only complete lines are
+    # echoed so the output of concurrent loggers never interleaves within a line
+    fd, tail = stream.fileno(), b""
     with open(path, "wb") as log_data:
-        for line in stream:
-            log_data.write(line)
-            with lock:
-                print(line.decode("utf-8"), end="", flush=True)
+        while True:
+            chunk = os.read(fd, PIPE_READ_SIZE)
+            if not chunk:
+                break
+            log_data.write(chunk)
+            head, newline, rest = chunk.rpartition(b"\n")
+            if newline:
+                echo((tail + head + newline).decode("utf-8"))
+                tail = rest
+            else:
+                tail += chunk
+        if tail:
+            echo(tail.decode("utf-8"))
+    echoed = threading.Event()
+    echo(echoed)
+    echoed.wait()
 
 
 # =============== #
@@ -1327,13 +1693,12 @@ def run_pipeline(
     elif tap.supports_properties:
         cmd += ["--properties", tap_catalog]
     print(f"Running pipeline {pipeline_id} ({tap} -> {target})")
-    stdout_lock = threading.Lock()
     mappers = tap.get_stream_maps(filesystem)
     with subprocess.Popen(
         cmd,
         stdout=subprocess.PIPE,
         stderr=subprocess.PIPE,
-        env={**os.environ, **tap.environment},
+        env=tap.process_env,
         cwd=filesystem.root_dir,
     ) as tap_proc, open(
         filesystem.log_path(f"state-{pipeline_id}.log"), "w"
@@ -1342,7 +1707,7 @@ def run_pipeline(
         stdin=tap_proc.stdout if not mappers else subprocess.PIPE,
         stderr=subprocess.PIPE,
         stdout=state_log,
-        env={**os.environ, **target.environment},
+        env=target.process_env,
         cwd=filesystem.root_dir,
     ) as target_proc:
         t1 = threading.Thread(
@@ -1350,7 +1715,6 @@ def run_pipeline(
             args=(
                 tap_proc.stderr,
                 filesystem.log_path(f"tap-{pipeline_id}.log"),
-                stdout_lock,
             ),
             daemon=True,
         )
@@ -1359,7 +1723,6 @@ def run_pipeline(
             args=(
                 target_proc.stderr,
                 filesystem.log_path(f"target-{pipeline_id}.log"),
-                stdout_lock,
             ),
             daemon=True,
         )
@@ -1403,7 +1766,7 @@ def get_remote_state(
     if execute:
         remote_state = filesystem.state_path(tap, target, remote=True)
         if filesystem.fs.exists(remote_state):
-            filesystem.fs.get(remote_state, filesystem.state_path(tap, target))
+            filesystem.get(remote_state, filesystem.state_path(tap, target))
 
 
 def update_remote_state(
@@ -1484,6 +1847,107 @@ def upload_logs(
 # ============== #
 
 
+def _json_bytes(obj: t.Any) -> bytes:
+    """Serialize an object to JSON bytes, using orjson if it is installed."""
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj)
+        except orjson.JSONEncodeError:
+            pass  # Fall back for values orjson rejects, such as integers over 64 bits
+    return json.dumps(obj).encode("utf-8")
+
+
+def _reservoir_buffer(header: bytes) -> gzip.GzipFile:
+    """Return a new gzip buffer for a reservoir file, starting with the schema header.
+
+    The compressed bytes are spooled to a temporary file so a large buffer spills to disk
+    rather than growing in memory. The isal implementation of gzip is used if installed.
+    """
+    buf = gzip_impl.GzipFile(
+        fileobj=tempfile.SpooledTemporaryFile(max_size=RESERVOIR_SPOOL_SIZE),
+        mode="wb",
+        compresslevel=RESERVOIR_COMPRESSLEVEL,
+    )
+    buf.write(header)
+    return buf
+
+
+def _upload_reservoir_buffer(filesystem: AltoFileSystem, path: str, buf: gzip.GzipFile) -> None:
+    """Close a reservoir buffer, upload it to the remote storage directory and release it."""
+    spool = buf.fileobj  # Closing the gzip file detaches it from the spool
+    buf.close()
+    with spool, filesystem.fs.open(path, "wb") as remote:
+        spool.seek(0)
+        shutil.copyfileobj(spool, remote, 1 << 20)
+
+
+def _write_state(path: str, stream_states: t.Dict[str, t.Any]) -> None:
+    """Write the state file atomically so a crash never leaves it half written."""
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as state_data:
+        state_data.write(_json_bytes(stream_states))
+    os.replace(tmp, path)
+
+
+def _read_batches(stream: t.IO[bytes], batches: "queue.Queue[t.Optional[t.List[bytes]]]") -> None:
+    """Read lines from a stream onto a queue in batches of about 64KiB, ending with a None.
+
+    Every line ends with a newline, only the last line of a stream can lack one so it is
+    added there rather than checked for on each line by the consumer.
+    """
+    try:
+        while True:
+            lines = stream.readlines(1 << 16)
+            if not lines:
+                break
+            if not lines[-1].endswith(b"\n"):
+                lines[-1] += b"\n"
+            batches.put(lines)
+    finally:
+        batches.put(None)
+
+
+def _parse_message(line: bytes) -> t.Optional[t.Dict[str, t.Any]]:
+    """Parse a line of tap output, returning None if it is not a Singer message.
+
+    orjson parses bytes directly and is much faster, but it turns integers over 64 bits into
+    floats and rejects some numbers json accepts such as 1e400. It is only trusted for RECORD
+    messages, whose raw line is what gets stored. STATE values and the SCHEMA a schema id is
+    hashed from are always parsed with json so they match what the tap emitted.
+    """
+    message = None
+    if orjson is not None:
+        try:
+            message = orjson.loads(line)
+        except orjson.JSONDecodeError:
+            pass
+    if not isinstance(message, dict) or message.get("type") != "RECORD":
+        try:
+            message = json.loads(line)
+        except ValueError:
+            return None
+    return message if isinstance(message, dict) else None
+
+
+def _scan_reservoir(filesystem: AltoFileSystem, base_path: str) -> t.Dict[str, t.List[str]]:
+    """Return the sorted reservoir files under a base path keyed by stream.
+
+    Files are laid out as <base_path>/<stream>/<schema_id>/<ts>.singer.gz, so a single
+    recursive listing finds every stream rather than one listing per stream.
+    """
+    found: t.Dict[str, t.List[str]] = {}
+    try:
+        paths = filesystem.fs.find(base_path)
+    except FileNotFoundError:
+        paths = []
+    for path in paths:
+        if path.endswith(".singer.gz"):
+            found.setdefault(path.rsplit("/", 3)[-3], []).append(path)
+    for stream_paths in found.values():
+        stream_paths.sort()
+    return found
+
+
 def reservoir_ingestor(
     stdout: t.IO[bytes],
     reservoir: t.Dict[str, t.List[str]],
@@ -1505,53 +1969,69 @@ def reservoir_ingestor(
         mappers = []
     record_buffer = {}
     active_schemas = {}
+    active_containers: t.Dict[str, t.Dict[str, t.Any]] = {}
+    schema_ids: t.Dict[bytes, str] = {}
+    last_state_write = 0.0
+
+    # Read the tap output on another thread so the tap is never left waiting on a full pipe
+    # while lines are parsed and compressed. Lines are handed over in batches to amortize
+    # the cost of the queue, which is bounded to hold the tap back if we fall behind.
+    batches: "queue.Queue[t.Optional[t.List[bytes]]]" = queue.Queue(maxsize=64)
+    threading.Thread(target=_read_batches, args=(stdout, batches), daemon=True).start()
 
     # Start the ingestion loop
     tpe = ThreadPoolExecutor(max_workers=os.cpu_count())
-    for line in stdout:
-        try:
-            message = json.loads(line.decode("utf-8"))
-        except json.JSONDecodeError:
-            pass
+    for line in itertools.chain.from_iterable(iter(batches.get, None)):
+        message = _parse_message(line)
+        if message is None:
+            continue  # Not a Singer message
+        typ = message.get("type")
 
         # Handle the state message
-        if message["type"] == "STATE":
+        if typ == "STATE":
             merge(message["value"], stream_states)
-            with open(state_path, "w") as f:
-                json.dump(stream_states, f)
+            # Taps can emit STATE very often, debounce the rewrites of the state file
+            if time.monotonic() - last_state_write > STATE_WRITE_INTERVAL:
+                _write_state(state_path, stream_states)
+                last_state_write = time.monotonic()
             continue
-        stream = message["stream"]
+        stream = message.get("stream")
 
         # Handle the schema message
-        if message["type"] == "SCHEMA":
+        if typ == "SCHEMA":
             for mapper in mappers:
                 message = mapper.transform_schema(message)
-            schema_id = md5(
-                json.dumps(message["schema"], sort_keys=True).encode("utf-8")
-            ).hexdigest()[:15]
+            # Taps tend to repeat the same SCHEMA line, only hash each distinct one once
+            schema_id = schema_ids.get(line)
+            if schema_id is None:
+                schema_id = md5(
+                    json.dumps(message["schema"], sort_keys=True).encode("utf-8")
+                ).hexdigest()[:15]
+                schema_ids[line] = schema_id
             if stream not in record_buffer or schema_id not in record_buffer[stream]:
                 # New stream
                 print(f"New stream: {stream} ({schema_id})")
-                buf, header = gzip.GzipFile(fileobj=io.BytesIO(), mode="wb"), line + b"\n"
-                buf.write(header)
+                header = line
                 record_buffer[stream] = {
                     schema_id: {
                         "count": 0,
                         "schema": message,
                         "header": header,
-                        "records": buf,
+                        "records": _reservoir_buffer(header),
                     }
                 }
             active_schemas[stream] = schema_id
+            # Records far outnumber schemas, resolve the buffer they go to here
+            active_containers[stream] = record_buffer[stream][schema_id]
 
         # Handle the record message
-        elif message["type"] == "RECORD":
+        elif typ == "RECORD":
             for mapper in mappers:
                 message = mapper.transform_record(message)
-            container = record_buffer[stream][active_schemas[stream]]
-            container["count"] += 1
-            container["records"].write(line + b"\n")
-            if container["count"] >= buffer_size:
+            container = active_containers[stream]
+            container["count"] = count = container["count"] + 1
+            container["records"].write(line)
+            if count >= buffer_size:
                 # Buffer is full, flush to filesystem
                 print(f"Flushing {stream} ({active_schemas[stream]})")
                 ts = datetime.datetime.utcnow().strftime("%Y%m%d%H%M%S%f")
@@ -1559,17 +2039,10 @@ def reservoir_ingestor(
                     f"{ts}.singer.gz",
                     key=record_key.format(stream=stream, schema_id=active_schemas[stream]),
                 )
-                _buf: gzip.GzipFile = container["records"]
-                inner_buf: io.BytesIO = _buf.fileobj
-                _buf.close()
-                inner_buf.flush(), inner_buf.seek(0)
-                tpe.submit(filesystem.fs.pipe, path, inner_buf.getvalue())
-                # Reset the buffer
+                tpe.submit(_upload_reservoir_buffer, filesystem, path, container["records"])
+                # Start a fresh buffer, the upload owns the old one
                 container["count"] = 0
-                inner_buf.truncate(0), inner_buf.seek(0)
-                new_buf = gzip.GzipFile(fileobj=inner_buf, mode="wb")
-                new_buf.write(container["header"])
-                container["records"] = new_buf
+                container["records"] = _reservoir_buffer(container["header"])
                 # Update the index
                 if stream not in reservoir:
                     reservoir[stream] = []
@@ -1578,8 +2051,8 @@ def reservoir_ingestor(
                 with open(filesystem.log_path(f"target-{pipeline_id}.log"), "a") as f:
                     f.write(f"{path}\n")
                 # Write actualized state to the remote storage directory
-                with open(state_path, "w") as state_data:
-                    json.dump(stream_states, state_data)
+                _write_state(state_path, stream_states)
+                last_state_write = time.monotonic()
 
     # Flush the remaining records
     print("Flushing remaining records")
@@ -1592,11 +2065,7 @@ def reservoir_ingestor(
                 f"{ts}.singer.gz",
                 key=record_key.format(stream=stream, schema_id=active_schemas[stream]),
             )
-            _buf: gzip.GzipFile = container["records"]
-            inner_buf: io.BytesIO = _buf.fileobj
-            _buf.close()
-            inner_buf.flush(), inner_buf.seek(0)
-            tpe.submit(filesystem.fs.pipe, path, inner_buf.getvalue())
+            tpe.submit(_upload_reservoir_buffer, filesystem, path, container["records"])
             # Update the index
             if stream not in reservoir:
                 reservoir[stream] = []
@@ -1608,26 +2077,42 @@ def reservoir_ingestor(
     # Write actualized state to the remote storage directory
     tpe.shutdown()
     print("Writing final state")
-    with open(state_path, "w") as state_data:
-        json.dump(stream_states, state_data)
+    _write_state(state_path, stream_states)
 
 
 # TODO: Add retry decorator
-def reservoir_emitter(
-    stdin: t.IO[bytes], path: str, filesystem: AltoFileSystem, lock: threading.Lock
-) -> str:
-    """Emits records from the reservoir to the target.
+def reservoir_reader(path: str, filesystem: AltoFileSystem) -> bytes:
+    """Reads records from the reservoir.
 
     This function is intended to be used as a target for a
     concurrent.futures.ThreadPoolExecutor, and is responsible
-    for pulling data from the reservoir, decompressing, and
-    emitting it to the stdin handle of the target process.
+    for pulling data from the reservoir and decompressing it
+    into newline delimited records ready for a target.
     """
-    stream = gzip.decompress(filesystem.fs.cat(path))
-    with lock:
-        # Write the records to the target's stdin handle with a lock
-        stdin.writelines((line + b"\n") for line in stream.splitlines() if line)
-    return path
+    stream = gzip_impl.decompress(filesystem.fs.cat(path))
+    # Older files stored each line with an extra newline, drop their blank lines in one pass
+    if b"\n\n" in stream or stream.startswith(b"\n"):
+        stream = b"\n".join(line for line in stream.split(b"\n") if line)
+    if stream and not stream.endswith(b"\n"):
+        stream += b"\n"
+    return stream
+
+
+def _prefetch(
+    tpe: "ThreadPoolExecutor",
+    fn: t.Callable[..., t.Any],
+    items: t.Iterable[t.Any],
+    *args: t.Any,
+    depth: int = RESERVOIR_PREFETCH,
+) -> t.Iterator[t.Any]:
+    """Yield fn(item, *args) for each item in order, running up to depth calls ahead."""
+    pending: t.Deque["Future"] = deque()
+    for item in items:
+        pending.append(tpe.submit(fn, item, *args))
+        if len(pending) >= depth:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
 
 
 def tap_to_reservoir(
@@ -1676,13 +2161,12 @@ def tap_to_reservoir(
     try:
         # Start the pipeline
         print(f"Running pipeline {pipeline_id} ({tap} -> {target})")
-        stdout_lock = threading.Lock()
         mappers = tap.get_stream_maps(filesystem)
         with subprocess.Popen(
             cmd,
             stdout=subprocess.PIPE,
             stderr=subprocess.PIPE,
-            env={**os.environ, **tap.environment},
+            env=tap.process_env,
             cwd=filesystem.root_dir,
         ) as tap_proc:
             # Stream stderr
@@ -1691,7 +2175,6 @@ def tap_to_reservoir(
                 args=(
                     tap_proc.stderr,
                     filesystem.log_path(f"tap-{pipeline_id}.log"),
-                    stdout_lock,
                 ),
                 daemon=True,
             )
@@ -1713,7 +2196,7 @@ def tap_to_reservoir(
             tap_proc.wait(), t1.join()
     finally:
         # Load the reservoir index from the remote storage directory
-        filesystem.fs.pipe(index_path, json.dumps(reservoir).encode("utf-8"))
+        filesystem.fs.pipe(index_path, _json_bytes(reservoir))
         # Drop the lock file
         filesystem.fs.delete(lock_path)
 
@@ -1726,7 +2209,6 @@ def reservoir_to_target(
     env: str,
 ) -> None:
     """Execute a data pipeline from the project reservoir."""
-    from collections import OrderedDict
     from concurrent.futures import ThreadPoolExecutor
 
     # Set up
@@ -1748,27 +2230,10 @@ def reservoir_to_target(
     index_path = filesystem._remote_path("_reservoir.json", key=base_path)
     if not filesystem.fs.exists(index_path):
         print("Reservoir index not found, rebuilding")
-        reservoir = {RESERVOIR_VERSION_KEY: 0}
-        streams = (
-            [
-                stream_directory.split("/")[-1]
-                for stream_directory in filesystem.fs.ls(base_path, detail=False)
-                if not filesystem.fs.isfile(stream_directory)
-            ]
-            if filesystem.fs.exists(base_path)
-            else []
-        )
-        for stream in streams:
-            reservoir[stream] = list(
-                sorted(
-                    filesystem.fs.glob(
-                        filesystem._remote_path("**.singer.gz", key=f"{base_path}/{stream}")
-                    )
-                )
-            )
+        reservoir = {RESERVOIR_VERSION_KEY: 0, **_scan_reservoir(filesystem, base_path)}
         filesystem.fs.pipe(
             filesystem._remote_path("_reservoir.json", key=base_path),
-            json.dumps(reservoir).encode("utf-8"),
+            _json_bytes(reservoir),
         )
         print("Reservoir index rebuilt")
     else:
@@ -1786,8 +2251,8 @@ def reservoir_to_target(
             if stream in (RESERVOIR_VERSION_KEY,) or stream not in stream_states:
                 continue
             # Update the state
-            for path in sorted(paths):
-                fname = path.split("/")[-1]
+            if paths:
+                fname = max(path.rsplit("/", 1)[-1] for path in paths)
                 if fname > stream_states[stream]["emitted"]:
                     stream_states[stream]["emitted"] = fname
         stream_states[RESERVOIR_VERSION_KEY] = reservoir[RESERVOIR_VERSION_KEY]
@@ -1797,14 +2262,12 @@ def reservoir_to_target(
 
     # Start the pipeline
     print(f"Running pipeline {pipeline_id} ({tap} -> {target})")
-    stdout_lock = threading.Lock()
-    reservoir_lock = threading.Lock()
     with subprocess.Popen(
         [target_bin, "--config", target_config],
         stdout=subprocess.PIPE,
         stderr=subprocess.PIPE,
         stdin=subprocess.PIPE,
-        env={**os.environ, **target.environment},
+        env=target.process_env,
         cwd=filesystem.root_dir,
     ) as target_proc:
         # Stream stderr
@@ -1813,7 +2276,6 @@ def reservoir_to_target(
             args=(
                 target_proc.stderr,
                 filesystem.log_path(f"target-{pipeline_id}.log"),
-                stdout_lock,
             ),
             daemon=True,
         )
@@ -1829,35 +2291,29 @@ def reservoir_to_target(
             if stream not in stream_states:
                 # Our bookmarks are alphanumerically sortable, so gt is sufficient
                 stream_states[stream] = {"emitted": ""}
-            work_queue = [
-                path for path in paths if path.split("/")[-1] > stream_states[stream]["emitted"]
-            ]
-            if not work_queue:
-                continue
+            emitted = stream_states[stream]["emitted"]
 
-            # Partition the paths by schema
-            paths_by_schema: t.Dict[str, t.List[t.Tuple[str, int]]] = OrderedDict()
-            for path in work_queue:
-                schema = path.split("/")[-2]
-                if schema not in paths_by_schema:
-                    paths_by_schema[schema] = []
-                paths_by_schema[schema].append(path)
+            # Partition the unemitted paths by schema, splitting each path once
+            paths_by_schema: t.Dict[str, t.List[str]] = {}
+            latest: t.Dict[str, str] = {}
+            for path in paths:
+                _, schema, fname = path.rsplit("/", 2)
+                if fname <= emitted:
+                    continue
+                paths_by_schema.setdefault(schema, []).append(path)
+                if fname > latest.get(schema, ""):
+                    latest[schema] = fname
 
             # Emit from the paths
             for schema, paths_to_emit in paths_by_schema.items():
                 print(f"Loading {len(paths_to_emit)} path(s) for {stream} (schema_id: {schema})")
-                job_res = tpe.map(
-                    reservoir_emitter,
-                    itertools.repeat(target_proc.stdin),
-                    [path for path in paths_to_emit],
-                    itertools.repeat(filesystem),
-                    itertools.repeat(reservoir_lock),
-                )
+                # Downloads run ahead while this thread, the only writer, emits in order
+                for records in _prefetch(tpe, reservoir_reader, paths_to_emit, filesystem):
+                    target_proc.stdin.write(records)
                 stream_states[stream]["emitted"] = max(
-                    stream_states[stream]["emitted"],
-                    max(path.split("/")[-1] for path in job_res),
+                    stream_states[stream]["emitted"], latest[schema]
                 )
-                with reservoir_lock, open(state, "w") as state_data:
+                with open(state, "w") as state_data:
                     json.dump(stream_states, state_data)
                 files_processed += len(paths_to_emit)
 
@@ -1868,6 +2324,26 @@ def reservoir_to_target(
         print(f"Processed {files_processed} file(s)")
 
 
+def _merge_reservoir_files(filesystem: AltoFileSystem, targets: t.List[str]) -> None:
+    """Merge sorted reservoir files into the last of them.
+
+    Gzip members can be concatenated, so the files are streamed one after another into a
+    staging file which then replaces the last of them. Only one chunk is held in memory, and
+    the staging suffix keeps a partial merge out of the index if the copy fails.
+    """
+    staging = targets[-1] + ".merging"
+    try:
+        with filesystem.fs.open(staging, "wb") as merged:
+            for path in targets:
+                with filesystem.fs.open(path, "rb") as part:
+                    shutil.copyfileobj(part, merged, 1 << 20)
+        filesystem.fs.mv(staging, targets[-1])
+    except Exception:
+        if filesystem.fs.exists(staging):
+            filesystem.fs.rm(staging)
+        raise
+
+
 def compact_reservoir(tap: str, filesystem: AltoFileSystem, env: str) -> None:
     """Compact the reservoir.
 
@@ -1875,9 +2351,6 @@ def compact_reservoir(tap: str, filesystem: AltoFileSystem, env: str) -> None:
     reducing the number of files in the reservoir and reducing the cost of running a
     pipeline from the reservoir.
     """
-    from collections import OrderedDict
-    from functools import reduce
-
     # Acquire lock
     base_path = f"reservoir/{env}/{tap}"
     lock_path = filesystem._remote_path("_reservoir.lock", key=base_path)
@@ -1896,6 +2369,7 @@ def compact_reservoir(tap: str, filesystem: AltoFileSystem, env: str) -> None:
 
     # Start the compact operation
     changed = False
+    merged: t.List[str] = []
     try:
         for stream, paths in reservoir.items():
             if stream in (RESERVOIR_VERSION_KEY,):
@@ -1904,13 +2378,11 @@ def compact_reservoir(tap: str, filesystem: AltoFileSystem, env: str) -> None:
             if not len(paths) > 1:
                 continue
             # Partition the paths by schema
-            paths_by_schema: t.Dict[str, t.List[t.Tuple[str, int]]] = OrderedDict()
+            paths_by_schema: t.Dict[str, t.List[t.Tuple[str, int]]] = {}
             path: str
             for path in paths:
-                schema = path.split("/")[-2]
-                if schema not in paths_by_schema:
-                    paths_by_schema[schema] = []
-                paths_by_schema[schema].append((path, filesystem.fs.size(path)))
+                schema = path.rsplit("/", 2)[-2]
+                paths_by_schema.setdefault(schema, []).append((path, filesystem.fs.size(path)))
             for schema, paths_with_size in paths_by_schema.items():
                 compactable = [(path, sz) for path, sz in paths_with_size if sz < 2.5e7]
                 if len(compactable) < 2:
@@ -1926,43 +2398,42 @@ def compact_reservoir(tap: str, filesystem: AltoFileSystem, env: str) -> None:
                             f"Merging {len(merge_queue)} file(s) for {stream} (schema_id: {schema})"
                         )
                         targets = list(sorted(merge_queue))
-                        filesystem.fs.pipe(
-                            targets[-1],
-                            reduce(lambda acc, n: acc + n, filesystem.fs.cat(targets).values()),
-                        )
-                        filesystem.fs.rm(targets[:-1])
+                        _merge_reservoir_files(filesystem, targets)
+                        merged.extend(targets[:-1])
                         merge_queue, queue_bytes = [], 0.0
                         changed = True
                 if merge_queue:
                     # Merge the remaining files
                     print(f"Merging {len(merge_queue)} file(s) for {stream} (schema_id: {schema})")
                     targets = list(sorted(merge_queue))
-                    filesystem.fs.pipe(
-                        targets[-1],
-                        reduce(lambda acc, n: acc + n, filesystem.fs.cat(targets).values()),
-                    ), filesystem.fs.rm(targets[:-1])
+                    _merge_reservoir_files(filesystem, targets)
+                    merged.extend(targets[:-1])
                     changed = True
     except Exception as e:
         # If we fail, just rebuild the index
         print(f"Compacting failed: {e}, rebuilding index")
         changed = True
+    finally:
+        # Remove the files folded into a merge in one batch, including those merged before
+        # a failure so the rebuilt index does not count their records twice
+        if merged:
+            try:
+                filesystem.fs.rm(merged)
+            except Exception as e:
+                print(f"Removing merged files failed: {e}, rebuilding index")
+                changed = True
 
     try:
         if changed:
             # Rebuild the index
             reservoir[RESERVOIR_VERSION_KEY] = reservoir.get(RESERVOIR_VERSION_KEY, 0) + 1
             streams = [k for k in reservoir.keys() if k != RESERVOIR_VERSION_KEY]
+            found = _scan_reservoir(filesystem, base_path)
             for stream in streams:
-                reservoir[stream] = list(
-                    sorted(
-                        filesystem.fs.glob(
-                            filesystem._remote_path("**.singer.gz", key=f"{base_path}/{stream}")
-                        )
-                    )
-                )
+                reservoir[stream] = found.get(stream, [])
             filesystem.fs.pipe(
                 filesystem._remote_path("_reservoir.json", key=base_path),
-                json.dumps(reservoir).encode("utf-8"),
+                _json_bytes(reservoir),
             )
             print("Reservoir index rebuilt")
         else:
@@ -1995,7 +2466,9 @@ def run_test(
     with subprocess.Popen(
         cmd,
         stdout=subprocess.PIPE if not test_flag_supported else None,
-        env={**os.environ, **tap.environment},
+        # Lines can run to many KB, a large buffer reads them in far fewer syscalls
+        bufsize=1 << 20,
+        env=tap.process_env,
         cwd=filesystem.root_dir,
     ) as proc:
         if test_flag_supported:
@@ -2004,9 +2477,11 @@ def run_test(
             passed = proc.returncode == 0
         else:
             for line in proc.stdout:
-                decoded_line = line.decode("utf-8")
+                # Skip SCHEMA and STATE messages without parsing them
+                if b'"RECORD"' not in line:
+                    continue
                 try:
-                    message = json.loads(decoded_line)
+                    message = json.loads(line)
                     # Ensure that the tap is producing RECORD messages
                     if message.get("type") == "RECORD" and message["record"]:
                         print(message)
@@ -2014,8 +2489,14 @@ def run_test(
                         break
                 except Exception:
                     continue
+            # Close our end first, a tap blocked writing to a full pipe then exits at once
+            proc.stdout.close()
             proc.terminate()
-            proc.wait()
+            try:
+                proc.wait(timeout=2)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+                proc.wait()
         if not passed:
             raise RuntimeError(f"Test for {tap} failed. See output above.")
 
@@ -2040,7 +2521,7 @@ def generate_catalog(tap: AltoPlugin, filesystem: AltoFileSystem) -> None:
                 [bin, "--config", config, "--discover"],
                 stdout=f,
                 check=True,
-                env={**os.environ, **tap.environment},
+                env=tap.process_env,
                 cwd=filesystem.root_dir,
             )
     except subprocess.CalledProcessError:
@@ -2048,7 +2529,7 @@ def generate_catalog(tap: AltoPlugin, filesystem: AltoFileSystem) -> None:
         os.remove(catalog)
         raise
     # Upload the catalog to the remote cache
-    filesystem.fs.put(catalog, filesystem.base_catalog_path(tap.name, remote=True))
+    filesystem.put(catalog, filesystem.base_catalog_path(tap.name, remote=True))
 
 
 def maybe_get_catalog(tap: AltoPlugin, filesystem: AltoFileSystem) -> bool:
@@ -2059,13 +2540,13 @@ def maybe_get_catalog(tap: AltoPlugin, filesystem: AltoFileSystem) -> bool:
     )
     if os.path.isfile(local):
         # Check if the pex is already in the remote cache
-        if not filesystem.fs.exists(remote):
+        if not filesystem.remote_exists(remote):
             # If not, upload it
-            filesystem.fs.put(local, remote)
+            filesystem.put(local, remote)
         return True
     try:
         # If the pex is not in the local cache, download it
-        filesystem.fs.get(remote, local)
+        filesystem.get(remote, local)
     except Exception:
         # If the pex is not in the remote cache, build it
         return False
@@ -2080,19 +2561,20 @@ def clean_catalog(tap: AltoPlugin, filesystem: AltoFileSystem) -> None:
     )
     if os.path.isfile(local):
         os.remove(local)
-    if filesystem.fs.exists(remote):
-        filesystem.fs.delete(remote)
+    if filesystem.remote_exists(remote):
+        filesystem.delete(remote)
 
 
 def render_modified_catalog(
     tap: AltoPlugin, filesystem: AltoFileSystem, return_obj: bool = False
 ) -> SingerCatalog:
     """Download the base catalog for a tap and apply user config to it."""
-    catalog = filesystem.catalog_path(tap.name)
-    shutil.copy(filesystem.base_catalog_path(tap.name), catalog)
-    disk_path_obj = Path(catalog)
-    apply_selected(disk_path_obj, tap.select)
-    rv = apply_metadata(disk_path_obj, tap.metadata)
+    rv = apply_selected_and_metadata(
+        Path(filesystem.base_catalog_path(tap.name)),
+        tap.select,
+        tap.metadata,
+        output=Path(filesystem.catalog_path(tap.name)),
+    )
     if return_obj:
         return rv
 
@@ -2117,30 +2599,31 @@ def render_config(
     accent: t.Optional[AltoPlugin] = None,
 ) -> dict:
     """Render a config file for a plugin."""
-    # Acquire the lock, this is necessary because the config rendering process
-    # is not thread-safe.
+    # Acquire the lock, this is necessary because @format values are resolved against the
+    # global settings when the config is read. Only that read needs to be serialized.
     with lock:
         # Set the namespace for the current plugin being rendered
-        original_namespace = deepcopy(settings["LOAD_PATH"])
+        original_namespace = settings["LOAD_PATH"]
         namespace_override = accent.namespace if accent is not None else plugin.namespace
         if namespace_override:
             settings["LOAD_PATH"] = namespace_override
 
-        # Apply accent
-        if accent is not None:
-            config = plugin.config_relative_to(accent)
-        else:
-            config = plugin.config
-
-        # Render the config
-        config_path = Path(filesystem.config_path(plugin.name, accent.name if accent else None))
-        config_path.parent.mkdir(parents=True, exist_ok=True)
-        runtime_config = config.to_dict()
-        with open(config_path, "w") as f:
-            json.dump(runtime_config, f, indent=2)
-
-        # Reset the namespace
-        settings["LOAD_PATH"] = original_namespace
+        try:
+            # Apply accent
+            if accent is not None:
+                config = plugin.config_relative_to(accent)
+            else:
+                config = plugin.config
+            runtime_config = config.to_dict()
+        finally:
+            # Reset the namespace
+            settings["LOAD_PATH"] = original_namespace
+
+    # Render the config
+    config_path = Path(filesystem.config_path(plugin.name, accent.name if accent else None))
+    config_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(config_path, "w") as f:
+        json.dump(runtime_config, f, indent=2)
 
     return runtime_config
 
@@ -2170,7 +2653,45 @@ def build_pex(plugin: AltoPlugin, filesystem: AltoFileSystem) -> None:
             raise
 
     # Upload the pex to the remote cache
-    filesystem.fs.put(output, filesystem.executable_path(plugin.pex_name, remote=True))
+    _upload_in_background(
+        filesystem, output, filesystem.executable_path(plugin.pex_name, remote=True)
+    )
+
+
+_UPLOAD_POOL: t.Optional["ThreadPoolExecutor"] = None
+_UPLOAD_POOL_LOCK = threading.Lock()
+_PENDING_UPLOADS: t.List[t.Tuple[str, "Future"]] = []
+
+
+def _upload_in_background(filesystem: AltoFileSystem, local: str, remote: str) -> None:
+    """Upload a file to the remote cache without waiting for it.
+
+    This lets the upload of one pex overlap with building the next. Call wait_for_uploads
+    once the builds are done to surface a failed upload. Reads of the same remote path
+    through the filesystem's remote_exists and get wait for the upload to finish first.
+    """
+    global _UPLOAD_POOL
+    from concurrent.futures import ThreadPoolExecutor
+
+    with _UPLOAD_POOL_LOCK:
+        if _UPLOAD_POOL is None:
+            _UPLOAD_POOL = ThreadPoolExecutor(max_workers=4, thread_name_prefix="alto-upload")
+        future = _UPLOAD_POOL.submit(filesystem.put, local, remote)
+        filesystem._track_upload(remote, future)
+        _PENDING_UPLOADS.append((local, future))
+
+
+def wait_for_uploads() -> None:
+    """Wait for the uploads started by build_pex, raising if any of them failed."""
+    with _UPLOAD_POOL_LOCK:
+        pending = _PENDING_UPLOADS[:]
+        _PENDING_UPLOADS.clear()
+    failed = [(local, future.exception()) for local, future in pending]
+    failed = [(local, e) for local, e in failed if e is not None]
+    if failed:
+        raise RuntimeError(
+            "Failed to upload to the remote cache: " + ", ".join(local for local, _ in failed)
+        ) from failed[0][1]
 
 
 def maybe_get_pex(plugin: AltoPlugin, filesystem: AltoFileSystem) -> bool:
@@ -2181,13 +2702,13 @@ def maybe_get_pex(plugin: AltoPlugin, filesystem: AltoFileSystem) -> bool:
     )
     if os.path.isfile(local):
         # Check if the pex is already in the remote cache
-        if not filesystem.fs.exists(remote):
+        if not filesystem.remote_exists(remote):
             # If not, upload it
-            filesystem.fs.put(local, remote)
+            filesystem.put(local, remote)
         return True
     try:
         # If the pex is not in the local cache, download it
-        filesystem.fs.get(remote, local)
+        filesystem.get(remote, local)
         os.chmod(local, 0o755)
     except Exception:
         # If the pex is not in the remote cache, build it
@@ -2205,7 +2726,7 @@ def maybe_remove_pex(plugin: AltoPlugin, filesystem: AltoFileSystem) -> bool:
         os.unlink(local)
     try:
         # If the pex is in the remote cache, remove it
-        filesystem.fs.delete(remote)
+        filesystem.delete(remote)
     except Exception:
         raise RuntimeError(f"Could not remove {remote} from remote cache. It may not exist.")
     return True
@@ -2247,14 +2768,17 @@ def make_plugins(
 ) -> t.Tuple[AltoPlugin, ...]:
     """Create a tuple of plugins from a list of plugin names.
 
-    This function will build the pexes for the plugins if they do not exist.
+    This function will build the pexes for the plugins if they do not exist. The plugins
+    are new instances, not the ones shared by the configuration, so callers may mutate them.
     """
     plugins = []
     for plugin_name in plugin_names:
-        plugin = configuration.get_plugin(plugin_name)
+        shared = configuration.get_plugin(plugin_name)
+        plugin = AltoPlugin(shared.name, typ=shared.type, config=configuration)
         if not maybe_get_pex(plugin, filesystem):
             build_pex(plugin, filesystem)
         plugins.append(plugin)
+    wait_for_uploads()
     return tuple(plugins)
 
 
@@ -2266,62 +2790,73 @@ class _QueueFileIterator(io.BytesIO):
     from the queue via the `__iter__` and `__next__` methods. Instances of
     this class should be used in a for loop to iterate over the records.
     Some iterations can be None, these should be ignored. A StopIteration
-    exception will be raised organically when the producer is finished.
+    exception will be raised once the writer calls `write_eof` and the queue
+    is drained.
     """
 
     def __init__(
-        self,
-        liveness_probe: t.Callable[[], bool],
-        poll_interval: int = 1,
-        records_only: bool = False,
+        self, records_only: bool = False, message_types: t.Optional[t.Iterable[str]] = None
     ):
         super().__init__()
-        self.queue = queue.Queue()
-        # Manage the queue
-        self.poll_interval = poll_interval
-        self.liveness_probe = liveness_probe
+        self.queue = queue.SimpleQueue()
         # Whether to only return records or all output, when records_only is
         # True, the output will be a tuple of (stream, record)
         self.records_only = records_only
+        # The message types to return, None returns every type
+        self.message_types = None if message_types is None else frozenset(message_types)
+        # Filtered out lines are recognized by their leading bytes and never decoded. STATE
+        # is always decoded since it is tracked here regardless of what is returned
+        self._skip_types = frozenset(
+            code
+            for code, typ in ((1, "RECORD"), (2, "SCHEMA"))
+            if self.message_types is not None and typ not in self.message_types
+        )
         # Store internal state
         self._state = {}
+        self._eof = False
 
     def write(self, data) -> int:
         self.queue.put(data)
         return len(data)
 
+    def write_eof(self) -> None:
+        """Signal that the writer is finished."""
+        self.queue.put(None)
+
     def __iter__(self):
         return self
 
     def __next__(self) -> t.Union[t.Tuple[str, t.Optional[str], dict], None]:
         """Callers should expect None values and should ignore them.
 
-        A StopIteration exception will be raised when the queue is empty. To the caller,
+        A StopIteration exception will be raised when the writer is finished. To the caller,
         we will appear to be a generator that yields Option<type, maybeStreamName, message>
         when iterated over with an organic termination.
         """
-        try:
-            data = self.queue.get(timeout=self.poll_interval)
-        except queue.Empty:
-            if not self.liveness_probe():
-                raise StopIteration
-            return None
-        else:
+        while not self._eof:
+            # Block until the writer hands over a line, the None it writes on exit ends iteration
+            data = self.queue.get()
+            if data is None:
+                self._eof = True
+                break
+            if self._skip_types:
+                try:
+                    if message_type(data) in self._skip_types:
+                        continue
+                except IndexError:
+                    pass  # Too short to peek at, let the decoder deal with it
             try:
                 msg = json.loads(data)
             except json.JSONDecodeError:
+                return None
+            if "type" not in msg:
                 pass
-            else:
-                if "type" not in msg:
-                    pass
-                if msg["type"] == "STATE":
-                    merge(msg["value"], self._state)
-                return msg["type"], msg.get("stream"), msg
-            finally:
-                self.queue.task_done()
-
-    def close(self) -> None:
-        self.queue.join()
+            if msg["type"] == "STATE":
+                merge(msg["value"], self._state)
+            if self.message_types is not None and msg["type"] not in self.message_types:
+                continue
+            return msg["type"], msg.get("stream"), msg
+        raise StopIteration
 
 
 @contextmanager
@@ -2332,8 +2867,12 @@ def tap_runner(
     state_key: str,
     records_only: bool = False,
     state_dict: t.Optional[dict] = None,
+    message_types: t.Optional[t.Iterable[str]] = None,
 ) -> t.Generator[_QueueFileIterator, None, None]:
-    """Run a tap and yield a file-like object that reads from the tap's stdout."""
+    """Run a tap and yield a file-like object that reads from the tap's stdout.
+
+    If message_types is given, only messages of those types are yielded.
+    """
     tap_bin, tap_config, tap_catalog = (
         filesystem.executable_path(tap.pex_name),
         filesystem.config_path(tap.name),
@@ -2360,29 +2899,44 @@ def tap_runner(
     with subprocess.Popen(
         cmd,
         stdout=subprocess.PIPE,
-        env={**os.environ, **tap.environment},
+        env=tap.process_env,
         cwd=filesystem.root_dir,
     ) as tap_proc:
-        singer_stream = _QueueFileIterator(
-            liveness_probe=lambda: tap_proc.poll() is None,
-            poll_interval=1,
-            records_only=records_only,
-        )
+        singer_stream = _QueueFileIterator(records_only=records_only, message_types=message_types)
+        mappers = tap.get_stream_maps(filesystem)
+        errors: t.List[BaseException] = []
+
+        def _proxy() -> None:
+            try:
+                map_worker(tap_proc.stdout, singer_stream, mappers)
+            except BaseException as e:
+                # Kept for the caller, an exception on this thread would be lost
+                errors.append(e)
+            finally:
+                # Always release the reader, even if a mapper fails
+                singer_stream.write_eof()
+
         # Shift proxying of messages to a separate thread
-        map_thread = threading.Thread(
-            target=map_worker,
-            args=(tap_proc.stdout, singer_stream, tap.get_stream_maps(filesystem)),
-            daemon=True,
-        )
+        map_thread = threading.Thread(target=_proxy, daemon=True)
         map_thread.start()
         # Return the stream
         yield singer_stream
-        # Cleanup
-        if tap_proc.returncode is not None and tap_proc.returncode != 0:
+        # Cleanup, the proxy returns once the tap closes its stdout or a mapper fails
+        map_thread.join()
+        if errors:
+            # Nothing reads the tap's stdout anymore, stop it rather than wait on a full pipe
+            tap_proc.terminate()
+            try:
+                tap_proc.wait(timeout=2)
+            except subprocess.TimeoutExpired:
+                tap_proc.kill()
+                tap_proc.wait()
+            raise errors[0]
+        tap_proc.wait()
+        if tap_proc.returncode != 0:
             raise RuntimeError(
                 f"Tap exited with code {tap_proc.returncode}"
             ) from subprocess.CalledProcessError(tap_proc.returncode, cmd)
-        tap_proc.terminate(), tap_proc.wait(), map_thread.join()
         # Update state
         if tap.supports_state:
             if state_dict is not None:
@@ -171,22 +171,24 @@ class AltoInvoke(Command):
             LOGGER.info("❌ Plugin name is required.")
             return 1
 
-        from alto.engine import build_pex, maybe_get_pex
+        from alto.engine import build_pex, maybe_get_pex, wait_for_uploads
 
         plugin = engine.configuration.get_plugin(plugin_name)
         if not maybe_get_pex(plugin, engine.filesystem):
             LOGGER.info(f"🔨 Building {plugin.name}...")
             build_pex(plugin, engine.filesystem)
         exe = engine.filesystem.executable_path(plugin.pex_name)
-        env = {**os.environ, **plugin.environment}
+        env = plugin.process_env
         if invoke_interpreter:
             LOGGER.info(f"🔨 Spawning Python interpreter in `{plugin.name}` plugin context...")
-            env.pop("PEX_MODULE", None)
-            env.pop("PEX_SCRIPT", None)
+            # The plugin's environment is shared, drop the entrypoint from a copy
+            env = {k: v for k, v in env.items() if k not in ("PEX_MODULE", "PEX_SCRIPT")}
         else:
             LOGGER.info(f"🔨 Invoking {plugin.name}...")
         with subprocess.Popen([exe, *pos_args], env=env, cwd=engine.filesystem.root_dir) as proc:
             proc.wait()
+        # A freshly built pex is uploaded while the plugin runs
+        wait_for_uploads()
 
 
 class AltoFs(Command):
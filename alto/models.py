@@ -146,6 +146,13 @@ class SingerCatalogStream(DataClassDictMixin, ParserMixin["SingerCatalogStream"]
                 return metadata
         return None
 
+    def root_metadata_index(self) -> Optional[int]:
+        """Return the index of the metadata entry with an empty breadcrumb, or None."""
+        for i, metadata in enumerate(self.metadata):
+            if metadata.is_root:
+                return i
+        return None
+
     def __post_init__(self) -> None:
         if self.stream is None:
             self.stream = self.tap_stream_id
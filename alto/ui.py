@@ -30,18 +30,8 @@ import doit.task
 from doit.reporter import ConsoleReporter
 from doit.task import Task
 
-try:
-    from rich.console import Console
-    from rich.progress import (
-        Progress,
-        SpinnerColumn,
-        TaskID,
-        TaskProgressColumn,
-        TextColumn,
-        TimeElapsedColumn,
-    )
-except ImportError:
-    TaskID = t.Any
+if t.TYPE_CHECKING:
+    from rich.progress import TaskID
 
 
 class InjectedIO:
@@ -87,10 +77,20 @@ def monkeypatch_stream(ui: "AltoRichUI") -> None:
 
 class AltoRichUI(ConsoleReporter):
     desc = "Alto Rich UI"
-    task_ids: t.Dict[str, TaskID] = {}
+    task_ids: t.Dict[str, "TaskID"] = {}
 
     def __init__(self, outstream, options):
         _ = outstream
+        # Deferred so only the rich UI pays for importing rich, raises ImportError if missing
+        from rich.console import Console
+        from rich.progress import (
+            Progress,
+            SpinnerColumn,
+            TaskProgressColumn,
+            TextColumn,
+            TimeElapsedColumn,
+        )
+
         self.console = Console()
         self.progress = Progress(
             SpinnerColumn(),
@@ -0,0 +1,198 @@
+# MIT License
+# Copyright (c) 2023 Alex Butler
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+"""Unit tests for alto catalog utilities"""
+import json
+import os
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+from alto.catalog import (
+    CatalogMutationStrategy,
+    _catalog_indent,
+    apply_metadata,
+    apply_selected,
+    apply_selected_and_metadata,
+)
+
+
+def _make_catalog() -> str:
+    """Make a small catalog for testing"""
+    return json.dumps(
+        {
+            "streams": [
+                {
+                    "tap_stream_id": "orders",
+                    "schema": {
+                        "type": "object",
+                        "properties": {
+                            "id": {"type": "integer"},
+                            "total": {"type": "number"},
+                            "customer": {
+                                "type": "object",
+                                "properties": {"email": {"type": "string"}},
+                            },
+                        },
+                    },
+                    "metadata": [
+                        {"breadcrumb": [], "metadata": {"inclusion": "available"}},
+                        {
+                            "breadcrumb": ["properties", "id"],
+                            "metadata": {"inclusion": "automatic"},
+                        },
+                        {"breadcrumb": ["properties", "total"], "metadata": {}},
+                        {"breadcrumb": ["properties", "customer"], "metadata": {}},
+                        {
+                            "breadcrumb": ["properties", "customer", "properties", "email"],
+                            "metadata": {},
+                        },
+                    ],
+                },
+                {
+                    "tap_stream_id": "users",
+                    "schema": {
+                        "type": "object",
+                        "properties": {
+                            "id": {"type": "integer"},
+                            "email": {"type": "string"},
+                        },
+                    },
+                    "metadata": [
+                        {"breadcrumb": ["properties", "id"], "metadata": {}},
+                        {"breadcrumb": ["properties", "email"], "metadata": {}},
+                    ],
+                },
+            ]
+        }
+    )
+
+
+class TestApplySelected(unittest.TestCase):
+    def test_select_all(self):
+        """Test selecting every stream and attribute"""
+        catalog = apply_selected(_make_catalog(), ["*.*"])
+        self.assertEqual([s.tap_stream_id for s in catalog.streams], ["orders", "users"])
+        for stream in catalog.streams:
+            self.assertTrue(stream.selected)
+            self.assertTrue(all(m.metadata["selected"] for m in stream.metadata))
+
+    def test_prune_unselected_stream(self):
+        """Test that unselected streams are pruned"""
+        catalog = apply_selected(_make_catalog(), ["users.*"])
+        self.assertEqual([s.tap_stream_id for s in catalog.streams], ["users"])
+
+    def test_deselect_unselected_stream(self):
+        """Test that unselected streams are deselected rather than pruned"""
+        catalog = apply_selected(
+            _make_catalog(), ["users.*"], strategy=CatalogMutationStrategy.DESELECT
+        )
+        self.assertEqual([s.selected for s in catalog.streams], [False, True])
+
+    def test_negated_attribute(self):
+        """Test that a negated attribute is removed from the schema"""
+        catalog = apply_selected(
+            _make_catalog(), ["orders.*", "!orders.customer.properties.email"]
+        )
+        (orders,) = catalog.streams
+        self.assertNotIn("customer", orders.schema["properties"])
+        self.assertIn("total", orders.schema["properties"])
+        self.assertNotIn(
+            ["properties", "customer", "properties", "email"],
+            [m.breadcrumb for m in orders.metadata],
+        )
+
+    def test_automatic_inclusion(self):
+        """Test that automatic attributes are always selected"""
+        catalog = apply_selected(_make_catalog(), ["orders.total"])
+        (orders,) = catalog.streams
+        self.assertEqual(set(orders.schema["properties"]), {"id", "total"})
+
+    def test_automatic_inclusion_order_independent(self):
+        """Test that automatic attributes are selected regardless of their position"""
+        data = json.loads(_make_catalog())
+        data["streams"][0]["metadata"].reverse()
+        catalog = apply_selected(json.dumps(data), ["orders.total"])
+        (orders,) = catalog.streams
+        self.assertEqual(set(orders.schema["properties"]), {"id", "total"})
+
+    def test_dict_catalog(self):
+        """Test that a catalog may be passed as an already decoded dict"""
+        catalog = apply_selected(json.loads(_make_catalog()), ["users.*"])
+        self.assertEqual([s.tap_stream_id for s in catalog.streams], ["users"])
+
+    def test_only_negations(self):
+        """Test that negations alone imply all streams are selected"""
+        catalog = apply_selected(_make_catalog(), ["!users.email"])
+        self.assertEqual([s.tap_stream_id for s in catalog.streams], ["orders", "users"])
+        self.assertNotIn("email", catalog.streams[1].schema["properties"])
+
+
+class TestApplyMetadata(unittest.TestCase):
+    def test_apply_metadata(self):
+        """Test applying metadata to matching streams"""
+        catalog = apply_metadata(
+            _make_catalog(),
+            {"o*": {"replication-method": "INCREMENTAL", "selected": False, "custom": 1}},
+        )
+        orders, users = catalog.streams
+        self.assertEqual(orders.replication_method, "INCREMENTAL")
+        self.assertEqual(orders.root_metadata().metadata["custom"], 1)
+        self.assertNotIn("custom", users.metadata[0].metadata)
+
+    def test_dict_catalog(self):
+        """Test that a catalog may be passed as an already decoded dict"""
+        catalog = apply_metadata(
+            json.loads(_make_catalog()), {"users": {"replication-method": "FULL_TABLE"}}
+        )
+        self.assertEqual(catalog.streams[1].replication_method, "FULL_TABLE")
+
+
+class TestApplySelectedAndMetadata(unittest.TestCase):
+    def test_apply_selected_and_metadata(self):
+        """Test that selections and metadata are applied in a single pass"""
+        catalog = apply_selected_and_metadata(
+            _make_catalog(), ["users.*"], {"users": {"replication-method": "FULL_TABLE"}}
+        )
+        (users,) = catalog.streams
+        self.assertTrue(users.selected)
+        self.assertEqual(users.replication_method, "FULL_TABLE")
+
+    def test_output_path(self):
+        """Test that the result is written to the output path, leaving the target untouched"""
+        with tempfile.TemporaryDirectory() as tmp:
+            base, output = Path(tmp, "base.json"), Path(tmp, "catalog.json")
+            base.write_text(_make_catalog())
+            apply_selected_and_metadata(base, ["users.*"], {}, output=output)
+            self.assertEqual(base.read_text(), _make_catalog())
+            streams = json.loads(output.read_text())["streams"]
+            self.assertEqual([s["tap_stream_id"] for s in streams], ["users"])
+
+
+class TestCatalogIndent(unittest.TestCase):
+    def test_indent_from_environment(self):
+        """Test that ALTO_CATALOG_INDENT sets the default catalog indent"""
+        with mock.patch.dict(os.environ, {"ALTO_CATALOG_INDENT": "4"}):
+            self.assertEqual(_catalog_indent(), 4)
+        with mock.patch.dict(os.environ, {"ALTO_CATALOG_INDENT": ""}):
+            self.assertIsNone(_catalog_indent())
+
+    def test_invalid_indent_falls_back_to_compact(self):
+        """Test that an ALTO_CATALOG_INDENT which is not an integer is ignored with a warning"""
+        with mock.patch.dict(os.environ, {"ALTO_CATALOG_INDENT": "yes"}):
+            with self.assertLogs("alto.logger", "WARNING"):
+                self.assertIsNone(_catalog_indent())
+
+
+if __name__ == "__main__":
+    unittest.main()
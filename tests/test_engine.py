@@ -0,0 +1,312 @@
+# MIT License
+# Copyright (c) 2023 Alex Butler
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+"""Unit tests for the alto engine"""
+import gzip
+import io
+import json
+import os
+import tempfile
+import threading
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from unittest import mock
+
+import alto.engine
+from alto.constants import ALTO_ROOT
+from alto.engine import AltoTaskEngine, _prefetch, reservoir_ingestor, reservoir_reader
+
+
+def _make_engine(root: str, **plugins) -> AltoTaskEngine:
+    """Make an engine for a project in root with the given plugins"""
+    config = {"default": {"project_name": os.urandom(4).hex(), **plugins}}
+    Path(root, "alto.json").write_text(json.dumps(config))
+    return AltoTaskEngine(root_dir=Path(root))
+
+
+_PLUGINS = {
+    "taps": {
+        "tap-a": {"pip_url": "tap-a", "capabilities": ["catalog", "state"]},
+        "tap-b": {"pip_url": "tap-b", "capabilities": ["catalog"]},
+    },
+    "targets": {"target-c": {"pip_url": "target-c"}},
+}
+
+
+class TestLoadTasks(unittest.TestCase):
+    def test_parallel_load_single_staging_dir(self):
+        """Test that generating tasks concurrently creates a single staging directory"""
+        with tempfile.TemporaryDirectory() as tmp:
+            engine = _make_engine(tmp, **_PLUGINS)
+            with mock.patch.object(alto.engine, "PARALLEL_LOAD", True):
+                tasks = engine.load_tasks(None, [])
+            self.assertTrue(tasks)
+            staging = [path for path in Path(tmp, ALTO_ROOT).iterdir() if path.name != "plugins"]
+            self.assertEqual(staging, [Path(engine.filesystem.stg_dir)])
+
+
+class TestLocalPaths(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.filesystem = _make_engine(tmp.name, **_PLUGINS).filesystem
+
+    def test_staging_dir_recreated_after_cleanup(self):
+        """Test that paths in the staging directory are writable after it was removed"""
+        Path(self.filesystem._temp_path("a.json", key="tap-a")).write_text("{}")
+        self.filesystem._remove_stg_dir()
+        Path(self.filesystem._temp_path("b.json", key="tap-a")).write_text("{}")
+
+    def test_cached_path_recreated_after_cleanup(self):
+        """Test that a path resolved before the staging directory was removed is writable"""
+        Path(self.filesystem._temp_path("a.json", key="tap-a")).write_text("{}")
+        self.filesystem._remove_stg_dir()
+        Path(self.filesystem._temp_path("a.json", key="tap-a")).write_text("{}")
+
+
+class TestSpecFor(unittest.TestCase):
+    def _spec_for(self, name: str, **taps):
+        """Resolve the spec of a plugin in a project with the given taps"""
+        with tempfile.TemporaryDirectory() as tmp:
+            return _make_engine(tmp, taps=taps).configuration.spec_for(name)
+
+    def test_self_inheriting_plugin(self):
+        """Test that a plugin which inherits from itself is rejected"""
+        with self.assertRaisesRegex(ValueError, "circular"):
+            self._spec_for("tap-a", **{"tap-a": {"inherit_from": "tap-a"}})
+
+    def test_inheritance_cycle(self):
+        """Test that an inherit_from cycle through several plugins is rejected"""
+        taps = {"tap-a": {"inherit_from": "tap-b"}, "tap-b": {"inherit_from": "tap-a"}}
+        with self.assertRaisesRegex(ValueError, "circular"):
+            self._spec_for("tap-a", **taps)
+
+    def test_missing_parent(self):
+        """Test that inheriting from a plugin which does not exist is rejected"""
+        with self.assertRaisesRegex(ValueError, "tap-z not found"):
+            self._spec_for("tap-a", **{"tap-a": {"inherit_from": "tap-z"}})
+
+
+class TestRemoteListing(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        # The local remote storage lives below the home directory
+        home = mock.patch.dict(os.environ, {"HOME": tmp.name})
+        home.start()
+        self.addCleanup(home.stop)
+        self.filesystem = _make_engine(tmp.name, **_PLUGINS).filesystem
+        self.local = os.path.join(tmp.name, "file.txt")
+        Path(self.local).write_text("data")
+        self.filesystem.fs.put(self.local, "cache/a.txt")
+        self.ls = mock.patch.object(self.filesystem.fs, "ls", wraps=self.filesystem.fs.ls)
+        self.ls = self.ls.start()
+        self.addCleanup(mock.patch.stopall)
+
+    def test_listing_is_cached(self):
+        """Test that probing files in the same directory lists it once"""
+        self.assertTrue(self.filesystem.remote_exists("cache/a.txt"))
+        self.assertFalse(self.filesystem.remote_exists("cache/b.txt"))
+        self.assertFalse(self.filesystem.remote_exists("missing/a.txt"))
+        self.assertEqual(self.ls.call_count, 2)
+
+    def test_put_and_delete_update_listing(self):
+        """Test that put and delete keep a cached listing accurate"""
+        self.assertFalse(self.filesystem.remote_exists("cache/b.txt"))
+        self.filesystem.put(self.local, "cache/b.txt")
+        self.assertTrue(self.filesystem.remote_exists("cache/b.txt"))
+        self.filesystem.delete("cache/a.txt")
+        self.assertFalse(self.filesystem.remote_exists("cache/a.txt"))
+        self.assertEqual(self.ls.call_count, 1)
+
+    def test_waits_for_background_upload(self):
+        """Test that a file being uploaded in the background is seen once its upload is done"""
+        self.assertFalse(self.filesystem.remote_exists("cache/b.txt"))
+        started, release = threading.Event(), threading.Event()
+        put = self.filesystem.fs.put
+
+        def slow_put(*args, **kwargs):
+            started.set()
+            release.wait(5)
+            return put(*args, **kwargs)
+
+        with mock.patch.object(self.filesystem.fs, "put", slow_put):
+            alto.engine._upload_in_background(self.filesystem, self.local, "cache/b.txt")
+            self.addCleanup(alto.engine.wait_for_uploads)
+            started.wait(5)
+            threading.Timer(0.1, release.set).start()
+            self.assertTrue(self.filesystem.remote_exists("cache/b.txt"))
+
+    def test_get_waits_for_background_upload(self):
+        """Test that downloading a file being uploaded in the background gets the upload"""
+        release = threading.Event()
+        put = self.filesystem.fs.put
+
+        def slow_put(*args, **kwargs):
+            release.wait(5)
+            return put(*args, **kwargs)
+
+        downloaded = os.path.join(os.path.dirname(self.local), "downloaded.txt")
+        with mock.patch.object(self.filesystem.fs, "put", slow_put):
+            alto.engine._upload_in_background(self.filesystem, self.local, "cache/b.txt")
+            self.addCleanup(alto.engine.wait_for_uploads)
+            threading.Timer(0.1, release.set).start()
+            self.filesystem.get("cache/b.txt", downloaded)
+        self.assertEqual(Path(downloaded).read_text(), "data")
+
+
+def _message(**message) -> bytes:
+    """Serialize a Singer message as a line of tap output"""
+    return json.dumps(message).encode("utf-8") + b"\n"
+
+
+class TestReservoirIngestor(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        # The local reservoir lives below the home directory
+        home = mock.patch.dict(os.environ, {"HOME": tmp.name})
+        home.start()
+        self.addCleanup(home.stop)
+        self.root = tmp.name
+        self.engine = _make_engine(tmp.name, **_PLUGINS)
+
+    def _ingest(self, *lines: bytes):
+        """Ingest tap output, returning the reservoir index and the final state"""
+        reservoir, state = {}, {}
+        reservoir_ingestor(
+            stdout=io.BytesIO(b"".join(lines)),
+            reservoir=reservoir,
+            record_key="reservoir/test/tap-a/{stream}/{schema_id}",
+            state_path=os.path.join(self.root, "state.json"),
+            pipeline_id="test",
+            filesystem=self.engine.filesystem,
+            stream_states=state,
+        )
+        return reservoir, state
+
+    def _read(self, path: str) -> bytes:
+        """Read a reservoir file back"""
+        return gzip.decompress(self.engine.filesystem.fs.cat(path))
+
+    def test_skips_lines_which_are_not_messages(self):
+        """Test that log lines and JSON values other than objects are skipped"""
+        record = _message(type="RECORD", stream="users", record={"id": 1})
+        reservoir, _ = self._ingest(
+            b"starting up\n",
+            b"1\n",
+            b'"x"\n',
+            _message(type="SCHEMA", stream="users", schema={"type": "object"}),
+            record,
+        )
+        (path,) = reservoir["users"]
+        self.assertTrue(self._read(path).endswith(record))
+
+    def test_numbers_json_accepts(self):
+        """Test that numbers orjson rejects are still ingested"""
+        record = b'{"type": "RECORD", "stream": "users", "record": {"id": 1e400}}\n'
+        reservoir, _ = self._ingest(
+            _message(type="SCHEMA", stream="users", schema={"type": "object"}), record
+        )
+        (path,) = reservoir["users"]
+        self.assertTrue(self._read(path).endswith(record))
+
+    def test_schema_id_with_large_integers(self):
+        """Test that a schema bounded by an integer over 64 bits keeps its schema id"""
+        schema = {
+            "type": "object",
+            "properties": {
+                "amount": {
+                    "type": ["null", "number"],
+                    "maximum": 10**20,
+                    "exclusiveMaximum": True,
+                    "multipleOf": 0.01,
+                }
+            },
+        }
+        reservoir, _ = self._ingest(
+            _message(type="SCHEMA", stream="orders", schema=schema),
+            _message(type="RECORD", stream="orders", record={"amount": 1.5}),
+            # A repeated SCHEMA line is served from the cache
+            _message(type="SCHEMA", stream="orders", schema=schema),
+            _message(type="RECORD", stream="orders", record={"amount": 2.5}),
+        )
+        (path,) = reservoir["orders"]
+        self.assertEqual(path.split("/")[-2], "b305adff28cfffc")
+
+    def test_state_keeps_large_integers(self):
+        """Test that integers over 64 bits in STATE are not turned into floats"""
+        _, state = self._ingest(_message(type="STATE", value={"bookmark": 10**20}))
+        self.assertEqual(state, {"bookmark": 10**20})
+        with open(os.path.join(self.root, "state.json")) as f:
+            self.assertEqual(json.load(f), {"bookmark": 10**20})
+
+    def test_reader_drops_blank_lines(self):
+        """Test that files written with a blank line after each record are read back as is"""
+        for written in (b"\n{}\n\n{}\n\n\n{}", b"{}\n{}\n{}\n", b"{}\n\n{}\n{}\n\n"):
+            self.engine.filesystem.fs.pipe("reservoir/old.singer.gz", gzip.compress(written))
+            with self.subTest(written=written):
+                self.assertEqual(
+                    reservoir_reader("reservoir/old.singer.gz", self.engine.filesystem),
+                    b"{}\n{}\n{}\n",
+                )
+
+
+class TestPrefetch(unittest.TestCase):
+    def setUp(self):
+        tpe = ThreadPoolExecutor(max_workers=4)
+        self.addCleanup(tpe.shutdown)
+        self.tpe = tpe
+
+    def test_yields_in_order(self):
+        """Test that results are yielded in the order of the items"""
+
+        def slow_first(item, offset):
+            if item == 0:
+                time.sleep(0.05)
+            return item + offset
+
+        results = list(_prefetch(self.tpe, slow_first, range(10), 100, depth=3))
+        self.assertEqual(results, list(range(100, 110)))
+
+    def test_runs_at_most_depth_ahead(self):
+        """Test that no more than depth calls are submitted ahead of the consumer"""
+        submitted = []
+        items = iter(range(10))
+
+        def tracked():
+            for item in items:
+                submitted.append(item)
+                yield item
+
+        results = _prefetch(self.tpe, lambda item: item, tracked(), depth=3)
+        self.assertEqual(next(results), 0)
+        self.assertEqual(submitted, [0, 1, 2])
+
+    def test_propagates_exceptions(self):
+        """Test that an exception raised on a prefetch thread reaches the consumer in order"""
+
+        def fail_on_two(item):
+            if item == 2:
+                raise ValueError("bad item")
+            return item
+
+        results = _prefetch(self.tpe, fail_on_two, range(5), depth=3)
+        self.assertEqual([next(results), next(results)], [0, 1])
+        with self.assertRaisesRegex(ValueError, "bad item"):
+            next(results)
+
+
+if __name__ == "__main__":
+    unittest.main()